@@ -4,25 +4,36 @@
 # Minesweeper but coded using Pygame (Not the best library or language for the job, but it made for a good quick project.
 
 
+import sys
+import time
 import pygame
+import ms_assets
 import ms_database
+import ms_generator
+import ms_profile
 import minesweeper
+from ms_events import EventLoop
 
 
 class Main:
 
     def __init__(self):
+        # Startup is timed from here to the first frame the user can interact with. Run with --timings to print it.
+        self.launched = time.perf_counter()
+        self.startup_time = None
+
         # Initialise pygame and create display.
         pygame.init()
         self.display = pygame.display.set_mode((850, 650))
         pygame.display.set_caption('Mine Sweeper')
-        icon = pygame.image.load('mine.png')
+        icon = ms_assets.get_image('mine.png')
         pygame.display.set_icon(icon)
         self.running = True
         self.signed_in = False
         
         # Initialise custom Database object.
         d = ms_database.Database()
+        self.database = d
         self.user = ''
         self.get_name()
 
@@ -30,10 +41,19 @@ class Main:
         self.g15 = Loader(self.display, d, self.user, (15, 15), 30, 20)
         self.g20 = Loader(self.display, d, self.user, (20, 20), 25, 40)
         self.g30 = Loader(self.display, d, self.user, (30, 30), 18, 80)
+        self.ng15 = Loader(self.display, d, self.user, (15, 15), 30, 20, True)
+        self.ng20 = Loader(self.display, d, self.user, (20, 20), 25, 40, True)
+        self.ng30 = Loader(self.display, d, self.user, (30, 30), 18, 80, True)
+        # Custom boards get their size from the start screen through pass_information.
+        self.custom = Loader(self.display, d, self.user, (15, 15), None, 20)
+        # Endless boards have no size or mine count, just ms_chunks' density.
+        self.endless = Loader(self.display, d, self.user, None, None, None)
         self.scores = Scores(self.display, d)
         
         # Screens are stored using a dictionary, and the object references can be retrieved and used from string keys returned in the mainloop.
-        self.screen_dict = {'start': self.start, '15': self.g15, '20': self.g20, '30': self.g30, 'scores': self.scores}
+        self.screen_dict = {'start': self.start, '15': self.g15, '20': self.g20, '30': self.g30,
+                            'ng15': self.ng15, 'ng20': self.ng20, 'ng30': self.ng30, 'custom': self.custom,
+                            'endless': self.endless, 'scores': self.scores}
         
         # Set the start screen as the first to be displayed.
         self.current_screen = self.start
@@ -52,6 +72,12 @@ class Main:
                     self.current_screen = self.screen_dict[returned[0]]
                     self.current_screen.pass_information(returned[1])
 
+        # Make sure any scores still queued are written before the program exits.
+        self.database.close()
+        ms_generator.shutdown()
+        # With --profile, write out the trace of everything timed this session.
+        ms_profile.export()
+
     def get_name(self):
         # Method will present a prompt for the user to enter details so the program can find them in the database or create their "account".
         
@@ -62,13 +88,13 @@ class Main:
                           (150, 150, 150))
         
         # Create title image instance to display later.
-        title = pygame.image.load('ms_title.png').convert_alpha()
-        title = pygame.transform.scale(title, (600, 80))
+        title = ms_assets.get_scaled('ms_title.png', (600, 80))
         title_pos = (125, 50)
         
         # Loop until the user has signed in.
+        loop = EventLoop()
         while not self.signed_in:
-            for event in pygame.event.get():
+            for event in loop.wait():
                 if event.type == pygame.QUIT:
                     self.running = False
                     return 'quit'
@@ -86,6 +112,9 @@ class Main:
                     returned = input_box.update(event)
                     self.process(returned)
 
+            if not loop.redraw:
+                continue
+
             self.display.fill((255, 255, 255))
 
             button.draw(self.display)
@@ -95,6 +124,13 @@ class Main:
             self.display.blit(title, title_pos)
 
             pygame.display.flip()
+            loop.drawn()
+
+            if self.startup_time is None:
+                self.startup_time = time.perf_counter() - self.launched
+                if '--timings' in sys.argv:
+                    print('Startup: {:.1f}ms (database {:.1f}ms)'.format(self.startup_time * 1000,
+                                                                         self.database.startup_time * 1000))
 
     def process(self, returned):
         # ??? Poor design ???
@@ -126,9 +162,10 @@ class Screen:
 
     def run(self):
         # Main loop
+        loop = EventLoop()
         while self.running:
             # Event loop - check for user input and other events (such as closed window).
-            for event in pygame.event.get():
+            for event in loop.wait():
                 if event.type == pygame.QUIT:
                     self.running = False
                     return 'quit'
@@ -149,9 +186,8 @@ class Screen:
                         returned = t.update(event)
                         self.process(returned)
 
-                for t in self.inputs:
-                    returned = t.update(event)
-                    self.process(returned)
+            if not loop.redraw:
+                continue
 
             self.screen.fill(self.colour)
 
@@ -165,6 +201,7 @@ class Screen:
                 v.draw(self.screen)
 
             pygame.display.flip()
+            loop.drawn()
 
     def process(self, returned):
         # Method will be overridden later.
@@ -183,18 +220,59 @@ class Start(Screen):
         b30 = Button((625, 300), (150, 100), '30x30', (0, 0, 0), 30, (150, 150, 150), (50, 50, 50), self.b30)
         quit_button = Button((425, 500), (100, 50), 'Quit', (0, 0, 0), 20, (200, 200, 200), (150, 150, 150), self.quit)
 
-        self.buttons = [b15, b20, b30, quit_button]
+        # Toggles whether the grid buttons start a normal game or a no-guess one.
+        self.no_guess = False
+        self.ng_button = Button((425, 400), (250, 50), 'No guessing: Off', (0, 0, 0), 20, (200, 200, 200),
+                                (150, 150, 150), self.toggle_no_guess)
+
+        self.buttons = [b15, b20, b30, self.ng_button, quit_button]
+
+        # Custom boards of any size, typed in as width, height and mines. Ones too big for the window get a Viewport.
+        self.custom_fields = {}
+        for x, field in ((175, 'width'), (275, 'height'), (375, 'mines')):
+            self.inputs.append(TextInput((x, 175), (80, 50), (0, 0, 0), 20, (200, 200, 200), (150, 150, 150), field))
+        self.buttons.append(Button((550, 175), (200, 50), 'Play custom', (0, 0, 0), 20, (200, 200, 200),
+                                   (150, 150, 150), self.custom))
+        self.buttons.append(Button((625, 500), (150, 50), 'Endless', (0, 0, 0), 20, (200, 200, 200), (150, 150, 150),
+                                   self.endless))
+        self.text_boxes['custom'] = TextBox((275, 125), (300, 30), 'Custom: width, height, mines', (0, 0, 0), 20,
+                                            (255, 255, 255))
 
     # Call back functions for determining which option the user selected.
     
     def b15(self):
-        return '15'
+        return self.prefix() + '15'
 
     def b20(self):
-        return '20'
+        return self.prefix() + '20'
 
     def b30(self):
-        return '30'
+        return self.prefix() + '30'
+
+    def prefix(self):
+        return 'ng' if self.no_guess else ''
+
+    def custom(self):
+        # No-guess generation is too slow for big boards, so custom boards are always normal games.
+        try:
+            width, height, mines = (int(self.custom_fields.get(f, '')) for f in ('width', 'height', 'mines'))
+        except ValueError:
+            width = height = mines = 0
+        if not (5 <= width <= 1000 and 5 <= height <= 1000 and 0 < mines <= width * height - 9):
+            self.text_boxes['custom'].update('Try e.g. 500, 500, 40000')
+            return
+        return ('custom', (width, height, mines))
+
+    def endless(self):
+        return 'endless'
+
+    def process(self, returned):
+        if returned:
+            self.custom_fields[returned[0]] = returned[1]
+
+    def toggle_no_guess(self):
+        self.no_guess = not self.no_guess
+        self.ng_button.set_text('No guessing: ' + ('On' if self.no_guess else 'Off'))
 
     def quit(self):
         return 'quit'
@@ -218,15 +296,26 @@ class Scores(Screen):
     def run(self):
         # Create ScoreBoard object if information is present to create one. Display Leaderboard information to the user.
         if self.information:
+            # The score just set may still be queued for writing, so wait for it to show up on the board.
+            self.database.flush()
             self.scoreboard = ScoreBoard((400, 300), (600, 400), ['No.', 'Name', 'Time', 'Date'],
                                          self.database, 1, self.information)
+        loop = EventLoop()
         while self.running:
-            for event in pygame.event.get():
+            for event in loop.wait():
                 if event.type == pygame.QUIT:
                     self.running = False
                     return 'quit'
 
                 elif event.type == pygame.MOUSEBUTTONDOWN:
+                    # Mouse wheel scrolls the scoreboard a page at a time.
+                    if event.button == 4:
+                        self.up()
+                        continue
+                    elif event.button == 5:
+                        self.down()
+                        continue
+
                     pos = pygame.mouse.get_pos()
 
                     for b in self.buttons:
@@ -234,6 +323,9 @@ class Scores(Screen):
                         if returned:
                             return returned
 
+            if not loop.redraw:
+                continue
+
             self.screen.fill(self.colour)
 
             for b in self.buttons:
@@ -244,6 +336,7 @@ class Scores(Screen):
             self.scoreboard.update(self.screen)
 
             pygame.display.flip()
+            loop.drawn()
 
     def pass_information(self, returned):
         self.information = returned
@@ -265,21 +358,41 @@ class Scores(Screen):
 class Loader:
     
     # Loader class instantiates the main game with all necessary parameters.
-    # In hindsight, perhaps slightly redundant.
+    # One Game is kept per preset and reset between plays rather than being rebuilt each time.
+    # No-guess presets start generating their boards in the background the first time they are played.
 
-    def __init__(self, screen, database, user, dimensions, size, mines):
+    def __init__(self, screen, database, user, dimensions, size, mines, no_guess=False):
         self.screen = screen
         self.database = database
         self.user = user
         self.dimensions = dimensions
         self.size = size
         self.mines = mines
+        self.no_guess = no_guess
+        self.config = None
+        self.game = None
 
     def run(self):
-        game = minesweeper.Game(self.screen, self.database, self.user, self.dimensions, self.size, self.mines)
-        returned = game.run()
+        if not self.game:
+            pool = None
+            if self.no_guess:
+                pool = ms_generator.BoardPool(self.dimensions[0], self.dimensions[1], self.mines)
+            self.game = minesweeper.Game(self.screen, self.database, self.user, self.dimensions, self.size, self.mines,
+                                         pool=pool, config=self.config)
+        returned = self.game.run()
+        # Clear the board straight away, so playing this preset again starts instantly.
+        self.game.reset()
         return returned
 
+    def pass_information(self, information):
+        # (width, height, mines) for a custom board. The Game is kept if the same board is played again.
+        width, height, mines = information
+        if ((width, height), mines) != (self.dimensions, self.mines) or not self.config:
+            self.dimensions = (width, height)
+            self.mines = mines
+            self.config = ms_database.custom_config(width, height, mines)
+            self.game = None
+
 
 class Button:
     
@@ -296,21 +409,32 @@ class Button:
 
         self.colour = self.inactive
 
-        self.font = pygame.font.SysFont('Comic Sans MS', self.font_size)
+        self.font = ms_assets.get_font('Comic Sans MS', self.font_size)
         self.text_image = self.font.render(self.text, 1, self.t_colour)
         self.text_rect = self.text_image.get_rect(center=[d // 2 for d in self.dimensions])
 
-        self.image = pygame.Surface(self.dimensions)
+        # The button only ever looks one of two ways, so both are rendered up front and draw just picks one.
+        self.images = {self.active: self.render(self.active), self.inactive: self.render(self.inactive)}
+        self.image = self.images[self.colour]
         self.rect = self.image.get_rect(center=self.position)
 
         self.func = func
 
+    def render(self, colour):
+        image = pygame.Surface(self.dimensions)
+        image.fill(colour)
+        image.blit(self.text_image, self.text_rect)
+        return image
+
+    def set_text(self, text):
+        self.text = text
+        self.text_image = self.font.render(self.text, 1, self.t_colour)
+        self.text_rect = self.text_image.get_rect(center=[d // 2 for d in self.dimensions])
+        self.images = {self.active: self.render(self.active), self.inactive: self.render(self.inactive)}
+
     def draw(self, screen):
         self.update()
-
-        self.image.fill(self.colour)
-        self.image.blit(self.text_image, self.text_rect)
-        screen.blit(self.image, self.rect)
+        screen.blit(self.images[self.colour], self.rect)
 
     def update(self):
         pos = pygame.mouse.get_pos()
@@ -341,15 +465,21 @@ class TextInput:
         self.colour = self.inactive
         self.clicked = False
 
-        self.font = pygame.font.SysFont('Comic Sans MS', self.font_size)
-        self.text_image = self.font.render(self.display_text, 1, self.t_colour)
-        self.text_rect = self.text_image.get_rect(center=[d // 2 for d in self.dimensions])
+        self.font = ms_assets.get_font('Comic Sans MS', self.font_size)
 
+        # One surface is kept for the life of the input and redrawn only when the text or colour changes.
         self.image = pygame.Surface(self.dimensions)
         self.rect = self.image.get_rect(center=self.position)
+        self.render()
 
         self.process = process
 
+    def render(self):
+        self.text_image = self.font.render(self.display_text, 1, self.t_colour)
+        self.text_rect = self.text_image.get_rect(center=[d // 2 for d in self.dimensions])
+        self.image.fill(self.colour)
+        self.image.blit(self.text_image, self.text_rect)
+
     def update(self, event):
         if self.clicked:
             if event.key == pygame.K_BACKSPACE:
@@ -358,6 +488,7 @@ class TextInput:
             elif event.key == pygame.K_RETURN:
                 self.clicked = False
                 self.colour = self.inactive
+                self.render()
                 return
             else:
                 character = chr(event.key)
@@ -370,36 +501,28 @@ class TextInput:
                     self.display_text += character
                     self.text += character
 
-            self.text_image = self.font.render(self.display_text, 1, self.t_colour)
-            self.text_rect = self.text_image.get_rect(center=[d // 2 for d in self.dimensions])
-
-            self.image = pygame.Surface(self.dimensions)
-            self.rect = self.image.get_rect(center=self.position)
+            self.render()
 
             return [self.process, self.text]
 
     def draw(self, screen):
-        self.image.fill(self.colour)
-        self.image.blit(self.text_image, self.text_rect)
         screen.blit(self.image, self.rect)
 
     def click_check(self, pos):
+        colour = self.colour
         if self.rect.collidepoint(pos):
             self.colour = self.active
             self.clicked = True
         else:
             self.colour = self.inactive
             self.clicked = False
+        if self.colour != colour:
+            self.render()
 
     def clear(self):
         self.text = ''
         self.display_text = ''
-
-        self.text_image = self.font.render(self.display_text, 1, self.t_colour)
-        self.text_rect = self.text_image.get_rect(center=[d // 2 for d in self.dimensions])
-
-        self.image = pygame.Surface(self.dimensions)
-        self.rect = self.image.get_rect(center=self.position)
+        self.render()
 
 
 class TextBox:
@@ -414,28 +537,34 @@ class TextBox:
         self.font_size = font_size
         self.colour = colour
 
-        self.font = pygame.font.SysFont('Comic Sans MS', self.font_size)
-        self.text_image = self.font.render(self.text, 1, self.t_colour)
-        self.text_rect = self.text_image.get_rect()
+        self.font = ms_assets.get_font('Comic Sans MS', self.font_size)
 
+        # The box is only re-rendered when its text actually changes, not every time it is drawn.
         self.image = pygame.Surface(self.dimensions)
         self.image.set_colorkey((250, 250, 250))
         self.rect = self.image.get_rect(center=self.position)
+        self.render()
 
-    def draw(self, screen):
+    def render(self):
+        self.text_image = self.font.render(self.text, 1, self.t_colour)
+        self.text_rect = self.text_image.get_rect()
         self.image.fill(self.colour)
         self.image.blit(self.text_image, self.text_rect)
+
+    def draw(self, screen):
         screen.blit(self.image, self.rect)
 
     def update(self, new_text):
-        self.text = new_text
-        self.text_image = self.font.render(self.text, 1, self.t_colour)
+        if new_text != self.text:
+            self.text = new_text
+            self.render()
 
 
 class ScoreBoard:
     
     # ScoreBoard object allows user to see previous high scores and who earned them on the database stored in the local filesystem.
     # Can accomodate many rows as user can scroll up and down using scroll buttons.
+    # Rows are fetched from the database a page of 10 at a time, and only the current page and its neighbours are kept.
 
     def __init__(self, position, dimensions, fields, database, index, table):
         self.position = position
@@ -449,10 +578,12 @@ class ScoreBoard:
         self.rect = self.image.get_rect(center=position)
 
         self.headers = self.make_headers()
-        self.columns, self.score_list = self.make_columns()
+        self.columns = self.make_columns()
 
+        # Pages hold one row more than is shown, if there is one, so there is no need to count the table to know
+        # whether there is a next page.
+        self.pages = {}
         self.multiplier = 0
-        self.limit = (len(self.score_list) // 10)
         self.assign_to_box()
 
     def make_headers(self):
@@ -465,10 +596,6 @@ class ScoreBoard:
         return headers
 
     def make_columns(self):
-        scores = self.db.return_scores(self.table)
-        # Sort the scores list by fastest time.
-        score_list = sorted(scores, key=lambda x: x[self.index])
-
         width_space = self.dimensions[0] / len(self.fields)
         height_space = self.dimensions[1] / 11
         columns = []
@@ -479,7 +606,7 @@ class ScoreBoard:
                                        (width_space - 1, 25), '', (255, 255, 255), 15, (250, 250, 250)))
             columns.append(t_boxes)
 
-        return columns, score_list
+        return columns
 
     def draw(self, screen):
         screen.blit(self.image, self.rect)
@@ -494,9 +621,12 @@ class ScoreBoard:
                 t.draw(self.image)
         self.draw(screen)
 
+    def has_next(self, page):
+        return len(self.get_page(page)) > 10
+
     def move_down(self):
         # Scroll down but only to the last page of rows.
-        if self.multiplier < self.limit:
+        if self.has_next(self.multiplier):
             self.multiplier += 1
             self.assign_to_box()
 
@@ -506,19 +636,35 @@ class ScoreBoard:
             self.multiplier -= 1
             self.assign_to_box()
     
+    def get_page(self, page):
+        # The database returns rows already sorted by fastest time.
+        if page not in self.pages:
+            self.pages[page] = self.db.return_scores(self.table, 11, 10 * page)
+        return self.pages[page]
+
+    def prefetch(self):
+        # Keep the pages either side of the current one ready for scrolling, and drop any others.
+        for page in list(self.pages):
+            if abs(page - self.multiplier) > 1:
+                del self.pages[page]
+        if self.multiplier > 0:
+            self.get_page(self.multiplier - 1)
+        if self.has_next(self.multiplier):
+            self.get_page(self.multiplier + 1)
+
     def assign_to_box(self):
         # Assign data to each row of the scoreboard base on scroll position and information retrieved from database.
+        rows = self.get_page(self.multiplier)
         for i in range(len(self.fields)):
             column = self.columns[i]
             for j in range(10):
-                column[j].update('')
-                try:
-                    if i == 0 and ((j + 1) + (10 * self.multiplier)) <= len(self.score_list):
-                        column[j].update(str((j + 1) + (10 * self.multiplier)))
-                    else:
-                        column[j].update(str(self.score_list[j + (10 * self.multiplier)][i - 1]))
-                except IndexError:
-                    pass
+                if j >= len(rows):
+                    column[j].update('')
+                elif i == 0:
+                    column[j].update(str((j + 1) + (10 * self.multiplier)))
+                else:
+                    column[j].update(str(rows[j][i - 1]))
+        self.prefetch()
 
 
 if __name__ == '__main__':
@@ -1,99 +1,120 @@
 import pygame
 import random
+import time
+import ms_profile
 from datetime import date
+from ms_assets import get_font, get_scaled
+from ms_board import Board
+from ms_chunks import CHUNK, ChunkedBoard
+from ms_events import EventLoop
+from ms_replay import FLAG, HINT, REVEAL, Replay, apply
+from ms_solver import solve
 
 LEFT = 1
+MIDDLE = 2
 RIGHT = 3
+WHEEL_UP = 4
+WHEEL_DOWN = 5
+
+# Boards that would need tiles smaller than this to fit on the screen are played through a Viewport instead.
+MIN_TILE = 12
+# The title, hint button and timer take up the top of the screen down to here, so no board may be drawn above it.
+HEADER = 55
+
+
+class TileAtlas:
+
+    # Prerendered surfaces for every state a tile can be drawn in: hidden, flagged, mine and revealed 0-8.
+    # One atlas is made per tile size and colour scheme and every tile of that kind blits from it.
+
+    atlases = {}
+
+    def __init__(self, size, colour, clicked_colour, font_size):
+        self.hidden = pygame.Surface((size - 1, size - 1))
+        self.hidden.fill(colour)
+
+        self.flagged = pygame.Surface((size - 1, size - 1))
+        self.flagged.fill((255, 0, 0))
+
+        self.mine = pygame.Surface((size - 1, size - 1))
+        self.mine.fill(clicked_colour)
+        pygame.draw.ellipse(self.mine, (0, 0, 0), (0, 0, size, size))
+
+        font = get_font('Comic Sans MS', font_size)
+        text_rect = font.render('', 1, (255, 0, 0)).get_rect(center=(size//2 - 2, size//2 - 2))
+        self.numbers = []
+        for n in range(9):
+            image = pygame.Surface((size - 1, size - 1))
+            image.fill(clicked_colour)
+            if n:
+                image.blit(font.render(str(n), 1, (255, 0, 0)), text_rect)
+            self.numbers.append(image)
+
+    @classmethod
+    def get(cls, size, colour, clicked_colour, font_size):
+        key = (size, colour, clicked_colour, font_size)
+        if key not in cls.atlases:
+            cls.atlases[key] = cls(size, colour, clicked_colour, font_size)
+        return cls.atlases[key]
+
+    def sprite(self, board, index):
+        if board.revealed[index]:
+            if board.mines[index]:
+                return self.mine
+            return self.numbers[board.numbers[index]]
+        elif board.flagged[index]:
+            return self.flagged
+        return self.hidden
 
 
 class Tile:
 
-    def __init__(self, size, position, colour=(255, 255, 255), clicked_colour=(150, 150, 150), font_size=15):
+    # Tile is a view over one cell of a Board. Its flags are read from and written to the board's arrays.
+
+    def __init__(self, board, index, size, position, colour=(255, 255, 255), clicked_colour=(150, 150, 150),
+                 font_size=15):
+        self.board = board
+        self.index = index
         self.size = size
         self.position = position
-        self.colour = colour
-        self.clicked_colour = clicked_colour
-        self.font_size = font_size
-        self.image = pygame.Surface((size - 1, size - 1))
-        self.image.fill((255, 255, 255))
-        self.rect = self.image.get_rect(center=position)
+        self.atlas = TileAtlas.get(size, colour, clicked_colour, font_size)
+        self.rect = pygame.Rect(0, 0, size - 1, size - 1)
+        self.rect.center = position
+
+    @property
+    def mine(self):
+        return bool(self.board.mines[self.index])
 
-        self.clicked = False
-        self.mine = False
-        self.warned = False
-        self.numbered = False
+    @property
+    def numbered(self):
+        return bool(self.board.numbers[self.index]) and not self.mine
 
-        self.font = pygame.font.SysFont('Comic Sans MS', self.font_size)
-        self.text_image = self.font.render('', 1, (255, 0, 0))
-        self.text_rect = self.text_image.get_rect(center=(size//2 - 2, size//2 - 2))
+    @property
+    def clicked(self):
+        return bool(self.board.revealed[self.index])
 
-        self.adjacents = []
+    @property
+    def warned(self):
+        return bool(self.board.flagged[self.index])
 
-    def update(self, screen, left, right, found):
+    def update(self, left, right):
+        # Grid has already resolved which tile was clicked, so left and right just say which buttons hit this one.
         if left:
-            if self.rect.collidepoint(left):
-                self.clicked = True
-                self.warned = False
-                if not self.numbered and not self.mine:
-                    connected = [self]
-                    visited = []
-                    while len(connected) != 0:
-                        current = connected.pop(0)
-                        visited.append(current)
-                        for a in current.get_adjacents():
-                            if a not in visited and not a.clicked:
-                                if not a.mine and not a.numbered:
-                                    a.clicked = True
-                                    connected.append(a)
-                                elif a.numbered:
-                                    a.clicked = True
-                elif self.mine:
-                    return 'lose'
+            self.board.reveal(self.index)
+            if self.mine:
+                return 'lose'
         if right:
-            if self.rect.collidepoint(right):
-                if not self.clicked:
-                    if self.warned:
-                        self.warned = False
-                        if self.mine:
-                            found -= 1
-                    else:
-                        self.warned = True
-                        if self.mine:
-                            found += 1
-
-        self.draw(screen)
-        return found
+            self.board.flag(self.index)
 
     def draw(self, screen):
-        if self.clicked:
-            self.image.fill(self.clicked_colour)
-            if self.mine:
-                pygame.draw.ellipse(self.image, (0, 0, 0), (0, 0, self.size, self.size))
-        elif self.warned:
-            self.image.fill((255, 0, 0))
-        else:
-            self.image.fill(self.colour)
-
-        if self.clicked and not self.warned:
-            self.image.blit(self.text_image, self.text_rect)
-        screen.blit(self.image, self.rect)
-
-    def assign_mine(self):
-        self.mine = True
-
-    def add_adjacent(self, tile):
-        self.adjacents.append(tile)
-
-    def get_adjacents(self):
-        return self.adjacents
-
-    def update_text(self, new_text):
-        self.text_image = self.font.render(new_text, 1, (255, 0, 0))
-        self.numbered = True
+        return screen.blit(self.atlas.sprite(self.board, self.index), self.rect)
 
 
 class Grid:
 
+    # Set on views of an endless ChunkedBoard, which can't be won, recorded or given hints.
+    endless = False
+
     def __init__(self, screen, dimensions, tile_size, position):
         self.screen = screen
         self.width, self.height = dimensions
@@ -103,173 +124,603 @@ class Grid:
         self.offset = (-(self.screen.get_width() - (self.width * self.tile_size)) // 2,
                        -(self.screen.get_height() - (self.height * self.tile_size)) // 2)
 
+        # The grid surface persists between frames and only tiles that have changed are redrawn onto it.
         self.image = pygame.Surface(((self.width * self.tile_size) + 1, (self.height * self.tile_size) + 1))
         self.rect = self.image.get_rect(center=position)
+        self.dirty_rects = []
+        # Number of tiles drawn by the last update, shown on the profiling overlay.
+        self.dirty_count = 0
+        # Index of the tile currently outlined as a hint, if any.
+        self.hint = None
 
-        self.tiles = self.generate_grid()
+        self.board = Board(self.width, self.height)
+        # Tiles in board index order, for looking up a tile from a click. Neighbours come from the Board.
+        self.cells = self.generate_grid()
 
     def generate_grid(self):
-        array = []
-
-        for y in range(self.tile_size//2, (self.height * self.tile_size), self.tile_size):
-            for x in range(self.tile_size//2, (self.width * self.tile_size), self.tile_size):
-                array.append(Tile(self.tile_size, (x, y)))
-
-        graph = {}
-        grid_dict = {tile.position: tile for tile in array}
-        grid_list = [tile.position for tile in array]
-        while len(grid_list) != 0:
-            graph, grid_dict, grid_list = self.find_adjacents(graph, grid_dict, grid_list)
-
-        return graph
-
-    def find_adjacents(self, graph, grid_dict, grid_list):
-        if len(grid_dict) == 0:
-            return graph, grid_dict, grid_list
-
-        current = grid_list.pop(0)
-        tile = grid_dict.pop(current)
-        position = tile.position
-        graph[position] = tile
-
-        left = (position[0] - self.tile_size, position[1])
-        right = (position[0] + self.tile_size, position[1])
-        up = (position[0], position[1] - self.tile_size)
-        down = (position[0], position[1] + self.tile_size)
-        ne = (position[0] + self.tile_size, position[1] - self.tile_size)
-        se = (position[0] + self.tile_size, position[1] + self.tile_size)
-        sw = (position[0] - self.tile_size, position[1] + self.tile_size)
-        nw = (position[0] - self.tile_size, position[1] - self.tile_size)
-
-        directions = [left, right, up, down, ne, se, sw, nw]
-
-        for i in range(len(directions)):
-            try:
-                square = grid_dict[directions[i]]
-            except KeyError:
-                continue
-            else:
-                tile.add_adjacent(square)
-                square.add_adjacent(tile)
+        # Tiles are created row by row, so their position in the list is their index on the board.
+        size = self.tile_size
+        centres = [(x, y) for y in range(size // 2, self.height * size, size)
+                   for x in range(size // 2, self.width * size, size)]
+        return [Tile(self.board, i, size, centre) for i, centre in enumerate(centres)]
+
+    def tile_at(self, pos):
+        # Map a position on the screen straight to the tile under it, or None if it is off the grid.
+        col = (pos[0] + self.offset[0]) // self.tile_size
+        row = (pos[1] + self.offset[1]) // self.tile_size
+        if 0 <= col < self.width and 0 <= row < self.height:
+            return self.cells[row * self.width + col]
+        return None
+
+    def index_at(self, pos):
+        tile = self.tile_at(pos)
+        return tile.index if tile else None
+
+    def handle(self, event):
+        # The whole grid is always on screen, so there is nothing to pan or zoom. See Viewport.
+        pass
+
+    def update(self, left, right):
+        with ms_profile.span('grid.update'):
+            if left:
+                tile = self.tile_at(left)
+                if tile and tile.update(True, False) == 'lose':
+                    return 'lose'
+            if right:
+                tile = self.tile_at(right)
+                if tile:
+                    tile.update(False, True)
+
+        with ms_profile.span('grid.draw_tiles'):
+            self.draw_changed()
+
+    def draw_changed(self):
+        # Redraw the changed tiles and copy just those areas to the screen, keeping their rects for display.update.
+        self.dirty_rects = []
+        changed = self.board.changed
+        self.dirty_count = len(changed)
+        if len(changed) > len(self.cells) // 4:
+            for i in changed:
+                self.draw_tile(i)
+            self.dirty_rects.append(self.draw())
+        else:
+            left, top = self.rect.topleft
+            for i in changed:
+                tile = self.draw_tile(i)
+                self.dirty_rects.append(self.screen.blit(self.image, tile.rect.move(left, top), tile.rect))
+        del changed[:]
+
+    def draw_tile(self, index):
+        tile = self.cells[index]
+        tile.draw(self.image)
+        if index == self.hint and not tile.clicked:
+            pygame.draw.rect(self.image, (255, 200, 0), tile.rect, 3)
+        return tile
+
+    def redraw(self):
+        # Draw every tile, e.g. at the start of a game. Pending changes are covered by this so they are dropped.
+        self.image.fill((0, 0, 0))
+        for i in range(len(self.cells)):
+            self.draw_tile(i)
+        del self.board.changed[:]
+        self.draw()
 
-        graph, grid_dict, grid_list = self.find_adjacents(graph, grid_dict, grid_list)
+    def show_hint(self):
+        # Outline a tile the solver says is certainly safe, or failing that the one least likely to be a mine.
+        safe, mines, probabilities = solve(self.board)
+        if safe:
+            hint = min(safe)
+        elif probabilities:
+            hint = min(probabilities, key=probabilities.get)
+        else:
+            return
+        self.set_hint(hint)
 
-        return graph, grid_dict, grid_list
+    def set_hint(self, hint):
+        if self.hint is not None:
+            self.board.changed.append(self.hint)
+        self.hint = hint
+        self.board.changed.append(hint)
 
-    def update(self, left, right, found):
-        if left:
-            left = (left[0] + self.offset[0], left[1] + self.offset[1])
-        if right:
-            right = (right[0] + self.offset[0], right[1] + self.offset[1])
-        self.image.fill((0, 0, 0))
+    def draw(self):
+        return self.screen.blit(self.image, self.rect)
 
-        for tile in self.tiles.values():
-            returned = tile.update(self.image, left, right, found)
-            if returned == 'lose':
-                return 'lose'
-            else:
-                found = returned
+    def add_mines(self, mines, seed=None):
+        # Mines are laid when the first tile is revealed, so the first click is always safe.
+        self.board.defer_mines(mines, random.Random(seed))
+        self.hint = None
+
+    def use_layout(self, mines, first):
+        # Start from a ready-made layout, such as a no-guess board, with the first cell already opened.
+        self.board.set_mines(mines)
+        self.board.reveal(first)
+        self.hint = None
+
+    def assign_text(self):
+        # Tiles draw their digits straight from the board's numbers through the shared TileAtlas.
+        self.board.assign_numbers()
 
+
+class Viewport(Grid):
+
+    # Inherits/Extends Grid, for boards far bigger than the screen. There are no Tile objects: only the cells inside
+    # the viewport are drawn, straight from the Board through a TileAtlas for the current zoom, onto a surface the size
+    # of the viewport. Memory and frame time depend on the viewport, not the board.
+    # Drag with the middle button or hold the arrow keys to pan, and use the mouse wheel to zoom.
+
+    ZOOMS = (4, 6, 8, 12, 16, 20, 25, 30)
+    # Pixels moved per frame while an arrow key is held.
+    PAN_STEP = 20
+
+    def __init__(self, screen, dimensions, tile_size, rect):
+        self.screen = screen
+        self.width, self.height = dimensions
+        self.rect = pygame.Rect(rect)
+        self.image = pygame.Surface(self.rect.size)
+        self.dirty_rects = []
+        self.dirty_count = 0
+        self.hint = None
+        # Set when the view has moved, so the whole viewport has to go to the screen this frame.
+        self.moved = False
+        self.dragging = False
+
+        self.board = Board(self.width, self.height)
+        self.set_zoom(tile_size)
+        # Pixel position on the whole board of the viewport's top left corner. Start looking at the middle.
+        self.scroll = (0, 0)
+        self.scroll_to((self.width * self.tile_size - self.rect.width) // 2,
+                       (self.height * self.tile_size - self.rect.height) // 2)
+
+    def set_zoom(self, tile_size):
+        # TileAtlas keeps one atlas per size, so the sprites for each zoom level are only made once.
+        self.tile_size = tile_size
+        self.atlas = TileAtlas.get(tile_size, (255, 255, 255), (150, 150, 150), max(6, tile_size // 2))
+
+    def scroll_to(self, x, y):
+        # Keep the view on the board, or centred on it along an axis where the board is smaller than the viewport.
+        def clamp(value, board, view):
+            if board <= view:
+                return (board - view) // 2
+            return max(0, min(value, board - view))
+
+        self.scroll = (clamp(x, self.width * self.tile_size, self.rect.width),
+                       clamp(y, self.height * self.tile_size, self.rect.height))
+
+    def pan(self, dx, dy):
+        # Shift what is already drawn and only draw the strips of cells that have come into view.
+        old_x, old_y = self.scroll
+        self.scroll_to(old_x + dx, old_y + dy)
+        dx, dy = self.scroll[0] - old_x, self.scroll[1] - old_y
+        if not dx and not dy:
+            return
+        w, h = self.rect.size
+        if abs(dx) >= w or abs(dy) >= h:
+            self.draw_area(self.image.get_rect())
+        else:
+            self.image.scroll(-dx, -dy)
+            if dx:
+                self.draw_area(pygame.Rect(w - dx if dx > 0 else 0, 0, abs(dx), h))
+            if dy:
+                self.draw_area(pygame.Rect(0, h - dy if dy > 0 else 0, w, abs(dy)))
+        self.moved = True
+
+    def zoom(self, step, pos):
+        # Move step levels through ZOOMS, keeping the point on the board under pos where it is.
+        levels = self.ZOOMS
+        current = min(range(len(levels)), key=lambda i: abs(levels[i] - self.tile_size))
+        tile_size = levels[max(0, min(current + step, len(levels) - 1))]
+        if tile_size == self.tile_size:
+            return
+        x, y = pos[0] - self.rect.x, pos[1] - self.rect.y
+        board_x = (x + self.scroll[0]) / self.tile_size
+        board_y = (y + self.scroll[1]) / self.tile_size
+        self.set_zoom(tile_size)
+        self.scroll_to(int(board_x * tile_size) - x, int(board_y * tile_size) - y)
+        self.draw_area(self.image.get_rect())
+        self.moved = True
+
+    def handle(self, event):
+        if event.type == pygame.MOUSEBUTTONDOWN:
+            if event.button == WHEEL_UP:
+                self.zoom(1, event.pos)
+            elif event.button == WHEEL_DOWN:
+                self.zoom(-1, event.pos)
+            elif event.button == MIDDLE:
+                self.dragging = True
+        elif event.type == pygame.MOUSEBUTTONUP and event.button == MIDDLE:
+            self.dragging = False
+        elif event.type == pygame.MOUSEMOTION and self.dragging:
+            self.pan(-event.rel[0], -event.rel[1])
+
+    def tile_at(self, pos):
+        return None
+
+    def index_at(self, pos):
+        if not self.rect.collidepoint(pos):
+            return None
+        col = (pos[0] - self.rect.x + self.scroll[0]) // self.tile_size
+        row = (pos[1] - self.rect.y + self.scroll[1]) // self.tile_size
+        if 0 <= col < self.width and 0 <= row < self.height:
+            return row * self.width + col
+        return None
+
+    def update(self, left, right):
+        keys = pygame.key.get_pressed()
+        dx = (keys[pygame.K_RIGHT] - keys[pygame.K_LEFT]) * self.PAN_STEP
+        dy = (keys[pygame.K_DOWN] - keys[pygame.K_UP]) * self.PAN_STEP
+        if dx or dy:
+            self.pan(dx, dy)
+
+        with ms_profile.span('grid.update'):
+            if left:
+                index = self.index_at(left)
+                if index is not None:
+                    self.board.reveal(index)
+                    if self.board.mines[index]:
+                        return 'lose'
+            if right:
+                index = self.index_at(right)
+                if index is not None:
+                    self.board.flag(index)
+
+        with ms_profile.span('grid.draw_tiles'):
+            self.draw_changed()
+
+    def draw_changed(self):
+        # Changed cells outside the view are skipped, as they will be drawn if they are scrolled to. If more cells
+        # changed than are in view, it is quicker to draw the whole view.
+        self.dirty_rects = []
+        changed = self.board.changed
+        self.dirty_count = len(changed)
+        area = self.image.get_rect()
+        if len(changed) * self.tile_size * self.tile_size > area.width * area.height:
+            self.draw_area(area)
+            self.moved = True
+        else:
+            left, top = self.rect.topleft
+            for i in changed:
+                rect = self.draw_tile(i)
+                if rect and not self.moved:
+                    # Cells on the edge of the view are only partly in it, so clip them to keep off the title.
+                    rect = rect.clip(area)
+                    self.dirty_rects.append(self.screen.blit(self.image, rect.move(left, top), rect))
+        del changed[:]
+        if self.moved:
+            self.dirty_rects = [self.draw()]
+            self.moved = False
+
+    def cell_rect(self, index):
+        # Where a cell is drawn on the viewport surface.
+        row, col = divmod(index, self.width)
+        size = self.tile_size
+        return pygame.Rect(col * size - self.scroll[0], row * size - self.scroll[1], size - 1, size - 1)
+
+    def draw_tile(self, index):
+        # Returns the rect drawn over, or None if the cell is out of view.
+        rect = self.cell_rect(index)
+        if not self.image.get_rect().colliderect(rect):
+            return None
+        self.image.blit(self.atlas.sprite(self.board, index), rect)
+        if index == self.hint and not self.board.revealed[index]:
+            pygame.draw.rect(self.image, (255, 200, 0), rect, 3 if self.tile_size >= MIN_TILE else 1)
+        return rect
+
+    def draw_area(self, area):
+        # Draw every cell overlapping area, a rect on the viewport surface, in one blits call.
+        size = self.tile_size
+        x, y = self.scroll
+        self.image.fill((200, 200, 200), area)
+        self.image.fill((0, 0, 0), area.clip(pygame.Rect(-x, -y, self.width * size, self.height * size)))
+        first_col = max((area.left + x) // size, 0)
+        last_col = min((area.right + x - 1) // size + 1, self.width)
+        first_row = max((area.top + y) // size, 0)
+        last_row = min((area.bottom + y - 1) // size + 1, self.height)
+
+        sprite = self.atlas.sprite
+        board = self.board
+        blits = []
+        for row in range(first_row, last_row):
+            top = row * size - y
+            start = row * self.width
+            for col in range(first_col, last_col):
+                blits.append((sprite(board, start + col), (col * size - x, top)))
+        self.image.blits(blits, doreturn=False)
+
+        if self.hint is not None:
+            row, col = divmod(self.hint, self.width)
+            if first_row <= row < last_row and first_col <= col < last_col:
+                self.draw_tile(self.hint)
+
+    def redraw(self):
+        self.draw_area(self.image.get_rect())
+        del self.board.changed[:]
         self.draw()
-        return found
 
-    def draw(self):
-        self.screen.blit(self.image, self.rect)
-
-    def add_mines(self, mines):
-        m = [tile for tile in self.tiles.values()]
-        for n in range(mines):
-            repeated = True
-            while repeated:
-                i = random.randint(0, (self.height * self.width) - 1)
-                if m[i].mine:
-                    repeated = True
-                else:
-                    m[i].assign_mine()
-                    repeated = False
+    def set_hint(self, hint):
+        # Bring the hint into view if it is off screen.
+        Grid.set_hint(self, hint)
+        if not self.image.get_rect().contains(self.cell_rect(hint)):
+            x, y = self.scroll
+            self.scroll_to(*self.cell_rect(hint).move(x - self.rect.width // 2, y - self.rect.height // 2).topleft)
+            self.draw_area(self.image.get_rect())
+            self.moved = True
 
-    def assign_text(self):
-        for tile in self.tiles.values():
-            if tile.mine:
-                continue
-            counter = 0
-            for a in tile.get_adjacents():
-                if a.mine:
-                    counter += 1
-            if counter == 0:
-                continue
-            else:
-                tile.update_text(str(counter))
+
+class EndlessViewport(Viewport):
+
+    # Inherits/Extends Viewport to play an endless ChunkedBoard, where cells are (x, y) pairs rather than indexes and
+    # the view can be panned without limit. Chunks are made as they are scrolled into view or flooded into.
+
+    endless = True
+
+    def __init__(self, screen, tile_size, rect):
+        self.screen = screen
+        self.width = self.height = None
+        self.rect = pygame.Rect(rect)
+        self.image = pygame.Surface(self.rect.size)
+        self.dirty_rects = []
+        self.dirty_count = 0
+        self.hint = None
+        self.moved = False
+        self.dragging = False
+
+        self.board = ChunkedBoard()
+        self.set_zoom(tile_size)
+        self.centre()
+
+    def centre(self):
+        # Look at the start cell, where the first click should go.
+        x, y = self.board.start
+        size = self.tile_size
+        self.scroll_to(x * size + size // 2 - self.rect.width // 2, y * size + size // 2 - self.rect.height // 2)
+
+    def scroll_to(self, x, y):
+        self.scroll = (x, y)
+
+    def add_mines(self, mines, seed=None):
+        # Every game is a new world. The number of mines is ignored, as they come from the board's density.
+        self.board.reset(seed)
+        self.centre()
+
+    def show_hint(self):
+        # The solver works on a whole Board, so there are no hints in endless mode.
+        pass
+
+    def index_at(self, pos):
+        if not self.rect.collidepoint(pos):
+            return None
+        return ((pos[0] - self.rect.x + self.scroll[0]) // self.tile_size,
+                (pos[1] - self.rect.y + self.scroll[1]) // self.tile_size)
+
+    def update(self, left, right):
+        keys = pygame.key.get_pressed()
+        dx = (keys[pygame.K_RIGHT] - keys[pygame.K_LEFT]) * self.PAN_STEP
+        dy = (keys[pygame.K_DOWN] - keys[pygame.K_UP]) * self.PAN_STEP
+        if dx or dy:
+            self.pan(dx, dy)
+
+        with ms_profile.span('grid.update'):
+            if left:
+                cell = self.index_at(left)
+                if cell is not None:
+                    self.board.reveal(cell)
+                    if self.board.lost:
+                        return 'lose'
+            if right:
+                cell = self.index_at(right)
+                if cell is not None:
+                    self.board.flag(cell)
+
+        with ms_profile.span('grid.draw_tiles'):
+            self.draw_changed()
+
+    def cell_rect(self, cell):
+        size = self.tile_size
+        return pygame.Rect(cell[0] * size - self.scroll[0], cell[1] * size - self.scroll[1], size - 1, size - 1)
+
+    def draw_tile(self, cell):
+        rect = self.cell_rect(cell)
+        if not self.image.get_rect().colliderect(rect):
+            return None
+        board, index = self.board.locate(cell)
+        self.image.blit(self.atlas.sprite(board, index), rect)
+        return rect
+
+    def draw_area(self, area):
+        # As Viewport.draw_area, a chunk at a time, making any chunk that hasn't been seen yet.
+        size = self.tile_size
+        x, y = self.scroll
+        self.image.fill((0, 0, 0), area)
+        first_col = (area.left + x) // size
+        last_col = (area.right + x - 1) // size + 1
+        first_row = (area.top + y) // size
+        last_row = (area.bottom + y - 1) // size + 1
+
+        sprite = self.atlas.sprite
+        blits = []
+        for cy in range(first_row // CHUNK, (last_row - 1) // CHUNK + 1):
+            for cx in range(first_col // CHUNK, (last_col - 1) // CHUNK + 1):
+                board = self.board.chunk(cx, cy)
+                cols = range(max(first_col, cx * CHUNK), min(last_col, (cx + 1) * CHUNK))
+                for row in range(max(first_row, cy * CHUNK), min(last_row, (cy + 1) * CHUNK)):
+                    top = row * size - y
+                    start = (row - cy * CHUNK) * CHUNK - cx * CHUNK
+                    for col in cols:
+                        blits.append((sprite(board, start + col), (col * size - x, top)))
+        self.image.blits(blits, doreturn=False)
+
+
+def viewport_rect(screen):
+    # Below the title, timer and hint button, with a margin around the rest.
+    return 25, 75, screen.get_width() - 50, screen.get_height() - 125
+
+
+def make_view(screen, dimensions, tile_size=None):
+    # Boards that fit on the screen are drawn whole by a Grid, and bigger ones through a Viewport below the title.
+    # Without a tile_size, the biggest that fits (up to 30) is used. No dimensions means an endless board.
+    if dimensions is None:
+        return EndlessViewport(screen, tile_size or 16, viewport_rect(screen))
+    width, height = dimensions
+    # A Grid is centred on the screen, so it leaves as much room below as the header takes above. Its image is a pixel
+    # bigger than its tiles for the border.
+    room = (screen.get_width() - 1, 2 * (screen.get_height() // 2 - HEADER))
+    if tile_size is None:
+        tile_size = min(30, room[0] // width, room[1] // height)
+    if tile_size >= MIN_TILE and width * tile_size <= room[0] and height * tile_size <= room[1]:
+        return Grid(screen, dimensions, tile_size, (screen.get_width() // 2, screen.get_height() // 2))
+    return Viewport(screen, dimensions, max(tile_size, 16), viewport_rect(screen))
 
 
 class Game:
 
-    def __init__(self, screen, database, user, dimensions=(15, 15), size=30, mines=20):
+    def __init__(self, screen, database, user, dimensions=(15, 15), size=30, mines=20, seed=None, pool=None,
+                 config=None):
         self.screen = screen
         self.database = database
         self.user = user
         self.mines = mines
+        # Leaderboard the score goes on. The presets use their width, e.g. 15.
+        self.config = config or (dimensions[0] if dimensions else 'endless')
+        self.seed = seed
+        # An ms_generator.BoardPool to take no-guess boards from, instead of laying mines at random.
+        self.pool = pool
+        self.running = True
+        # A size of None fits the board to the screen. Boards too big for it are played through a Viewport, and
+        # dimensions of None give an endless board.
+        self.grid = make_view(self.screen, dimensions, size)
+        self.clock = pygame.time.Clock()
+        self.time = 0
+        # Recording of the game being played, or of the last one once it is over.
+        self.replay = None
+
+        self.title = get_scaled('ms_title.png', (350, 50))
+
+    def reset(self, seed=None):
+        # Get ready for another game on the same Grid, so its tiles and sprites don't have to be built again.
+        self.grid.board.reset()
+        self.seed = seed
         self.running = True
-        width = self.screen.get_width() // 2
-        height = self.screen.get_height() // 2
-        self.grid = Grid(self.screen, dimensions, size, (width, height))
         self.clock = pygame.time.Clock()
         self.time = 0
 
     def run(self):
-        self.grid.add_mines(self.mines)
-        self.grid.assign_text()
+        # Endless games have no fixed layout to record.
+        self.replay = None if self.grid.endless else Replay(self.grid.width, self.grid.height, self.mines, self.seed)
+        if self.pool:
+            if not self.pool.ready() and self.wait_for_board() == 'quit':
+                self.running = False
+                return 'quit'
+            self.grid.use_layout(self.pool.take(), self.pool.first)
+            self.replay.add(0, REVEAL, self.pool.first)
+        else:
+            self.grid.add_mines(self.mines, self.seed)
 
-        title = pygame.image.load('ms_title.png').convert_alpha()
-        title = pygame.transform.scale(title, (350, 50))
-        y = ((self.screen.get_height() - (self.grid.height * self.grid.tile_size)) // 2) - 50
-        title_pos = (250, y)
+        title = self.title
+        title_pos = (250, self.grid.rect.top - 50)
 
-        found = 0
         timer = TextBox((750, 35), (175, 40), '', (0, 0, 0), 20, (255, 255, 255))
+        # Clicking this or pressing H asks the solver for a hint.
+        hint = TextBox((85, 35), (130, 40), 'Hint (H)', (0, 0, 0), 20, (255, 255, 255))
+        # With profiling on, frame stats are shown along the bottom, refreshed a few times a second.
+        overlay = TextBox((215, self.screen.get_height() - 20), (410, 30), '', (0, 0, 0), 16, (255, 255, 255))
+        overlay_refreshed = 0
+
+        # Draw the whole screen once, after which each frame only pushes the areas that changed.
+        self.screen.fill((200, 200, 200))
+        self.grid.redraw()
+        self.screen.blit(title, title_pos)
+        hint.draw(self.screen)
+        pygame.display.flip()
 
         while self.running:
+            frame_start = time.perf_counter()
             dt = self.clock.get_time() / 1000
             self.time += dt
             template = str(self.user) + ', {:8.2f}s'
             timer.update(template.format(self.time, 2))
-            left_pos = None
-            right_pos = None
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    self.running = False
-                    return 'quit'
-                if event.type == pygame.MOUSEBUTTONDOWN:
-                    if event.button == LEFT:
-                        left_pos = pygame.mouse.get_pos()
-                    elif event.button == RIGHT:
-                        right_pos = pygame.mouse.get_pos()
-
-            self.screen.fill((200, 200, 200))
-            returned = self.grid.update(left_pos, right_pos, found)
-            if returned == 'lose':
+            with ms_profile.span('events'):
+                for event in pygame.event.get():
+                    self.grid.handle(event)
+                    if event.type == pygame.QUIT:
+                        self.running = False
+                        return 'quit'
+                    if event.type == pygame.MOUSEBUTTONDOWN:
+                        if event.button == LEFT:
+                            # A click on the hint button is never a click on the board as well.
+                            if hint.rect.collidepoint(event.pos):
+                                self.show_hint()
+                            else:
+                                self.click(REVEAL, event.pos)
+                        elif event.button == RIGHT:
+                            self.click(FLAG, event.pos)
+                    elif event.type == pygame.KEYDOWN and event.key == pygame.K_h:
+                        self.show_hint()
+                    # Clicks after the one that ended the game are never applied, so they aren't recorded either.
+                    if self.grid.board.status() != 'playing':
+                        break
+
+            self.grid.update(None, None)
+            if self.grid.board.status() == 'lost':
+                if self.replay:
+                    self.replay.finish(self.grid.board)
                 returned = self.lose()
                 self.running = False
                 return returned
-            else:
-                found = returned
 
             timer.draw(self.screen)
-            self.screen.blit(title, title_pos)
 
-            w = 0
-            for t in self.grid.tiles.values():
-                if t.warned:
-                    w += 1
-
-            if found == self.mines and found == w:
+            if self.grid.board.status() == 'won':
+                self.replay.finish(self.grid.board)
                 returned = self.win()
                 self.running = False
                 return returned
 
-            pygame.display.flip()
+            rects = self.grid.dirty_rects + [timer.rect]
+            if ms_profile.enabled:
+                if frame_start - overlay_refreshed > 0.25:
+                    overlay_refreshed = frame_start
+                    overlay.update('{:5.1f} fps  p50 {:5.2f}ms  p99 {:5.2f}ms  {} dirty'.format(
+                        self.clock.get_fps(), ms_profile.percentile(50) * 1000, ms_profile.percentile(99) * 1000,
+                        self.grid.dirty_count))
+                overlay.draw(self.screen)
+                rects.append(overlay.rect)
+
+            with ms_profile.span('display.update'):
+                pygame.display.update(rects)
+            if ms_profile.enabled:
+                ms_profile.frame(frame_start, time.perf_counter(), self.grid.dirty_count)
             self.clock.tick(60)
 
+    def wait_for_board(self):
+        # The first no-guess board can take a few seconds while the workers start, so keep the window responsive.
+        message = TextBox((self.screen.get_width() // 2, self.screen.get_height() // 2), (600, 100),
+                          'Generating a no-guess board...', (0, 0, 0), 25, (200, 200, 200))
+        loop = EventLoop(timeout=100)
+        while not self.pool.ready():
+            for event in loop.wait():
+                if event.type == pygame.QUIT:
+                    return 'quit'
+            if loop.redraw:
+                self.screen.fill((200, 200, 200))
+                message.draw(self.screen)
+                pygame.display.flip()
+                loop.drawn()
+
+    def click(self, action, pos):
+        # Apply a click to the board as soon as it is handled, so the replay holds every click in the order it took
+        # effect. The next grid.update draws whatever it changed.
+        index = self.grid.index_at(pos)
+        if index is None:
+            return
+        if self.replay:
+            self.replay.add(self.time, action, index)
+        apply(self.grid.board, action, index)
+
+    def show_hint(self):
+        self.grid.show_hint()
+        if self.grid.hint is not None:
+            self.replay.add(self.time, HINT, self.grid.hint)
+
     def win(self):
         m1 = TextBox((self.screen.get_width() // 2, self.screen.get_height() // 2),
                      (600, 100), 'You Win!', (0, 0, 0), 30, (0, 255, 0))
@@ -277,27 +728,34 @@ class Game:
                      (600, 100), 'Press ENTER to quit.', (0, 0, 0), 20, (0, 255, 0))
         messages = [m1, m2]
 
+        # The score is queued now so it is written in the background while the win screen is up.
+        if self.database:
+            self.database.add_score(self.user, round(self.time, 2), date.today().strftime('%d/%m/%Y'), self.config,
+                                    self.replay.to_bytes())
+
         done = False
+        loop = EventLoop()
         while not done:
 
-            for event in pygame.event.get():
+            for event in loop.wait():
                 if event.type == pygame.QUIT:
                     done = True
                 elif event.type == pygame.KEYDOWN:
                     if event.key == pygame.K_RETURN:
                         done = True
 
+            if not loop.redraw:
+                continue
+
             self.screen.fill((0, 255, 0))
 
             for m in messages:
                 m.draw(self.screen)
 
             pygame.display.flip()
+            loop.drawn()
 
-        if self.database:
-            self.database.add_score(self.user, round(self.time, 2), date.today().strftime('%d/%m/%Y'), self.grid.width)
-
-        table = ('scores', self.grid.width)
+        table = ('scores', self.config)
 
         return table
 
@@ -307,27 +765,86 @@ class Game:
         m2 = TextBox((self.screen.get_width() // 2, self.screen.get_height() // 2 + 150),
                      (600, 100), 'Press ENTER to quit.', (0, 0, 0), 20, (255, 0, 0))
         messages = [m1, m2]
+        if self.grid.endless:
+            # Endless games can only be lost, so say how far this one got.
+            m1.update('You cleared ' + str(self.grid.board.revealed_safe) + ' cells!')
 
         done = False
+        loop = EventLoop()
         while not done:
 
-            for event in pygame.event.get():
+            for event in loop.wait():
                 if event.type == pygame.QUIT:
                     done = True
                 elif event.type == pygame.KEYDOWN:
                     if event.key == pygame.K_RETURN:
                         done = True
 
+            if not loop.redraw:
+                continue
+
             self.screen.fill((255, 0, 0))
 
             for m in messages:
                 m.draw(self.screen)
 
             pygame.display.flip()
+            loop.drawn()
 
         return 'start'
 
 
+class Playback:
+
+    # Plays a Replay back on a Grid in real time, or faster or slower by speed. ENTER or closing the window stops it.
+
+    def __init__(self, screen, replay, speed=1.0):
+        self.screen = screen
+        self.replay = replay
+        self.speed = speed
+        self.grid = make_view(screen, (replay.width, replay.height))
+
+    def run(self):
+        board = self.grid.board
+        board.set_mines(self.replay.layout)
+        self.grid.hint = None
+
+        timer = TextBox((750, 35), (175, 40), '', (0, 0, 0), 20, (255, 255, 255))
+        self.screen.fill((200, 200, 200))
+        self.grid.redraw()
+        pygame.display.flip()
+
+        clock = pygame.time.Clock()
+        elapsed = 0
+        actions = self.replay.actions
+        n = 0
+        while True:
+            for event in pygame.event.get():
+                self.grid.handle(event)
+                if event.type == pygame.QUIT:
+                    return 'quit'
+                if event.type == pygame.KEYDOWN and event.key == pygame.K_RETURN:
+                    return
+
+            # Apply every action due by now, then draw them all in one go.
+            elapsed += clock.get_time() * self.speed
+            while n < len(actions) and actions[n][0] <= elapsed:
+                ms, index, action = actions[n]
+                if action == HINT:
+                    self.grid.set_hint(index)
+                else:
+                    apply(board, action, index)
+                n += 1
+            if n == len(actions):
+                elapsed = actions[-1][0] if actions else 0
+
+            timer.update('{:8.2f}s {}'.format(elapsed / 1000, board.status() if n == len(actions) else ''))
+            timer.draw(self.screen)
+            self.grid.update(None, None)
+            pygame.display.update(self.grid.dirty_rects + [timer.rect])
+            clock.tick(60)
+
+
 class TextBox:
 
     def __init__(self, position, dimensions, text, t_colour, font_size, colour):
@@ -338,22 +855,27 @@ class TextBox:
         self.font_size = font_size
         self.colour = colour
 
-        self.font = pygame.font.SysFont('Comic Sans MS', self.font_size)
-        self.text_image = self.font.render(self.text, 1, self.t_colour)
-        self.text_rect = self.text_image.get_rect()
+        self.font = get_font('Comic Sans MS', self.font_size)
 
+        # The box is only re-rendered when its text actually changes, not every time it is drawn.
         self.image = pygame.Surface(self.dimensions)
         self.image.set_colorkey((250, 250, 250))
         self.rect = self.image.get_rect(center=self.position)
+        self.render()
 
-    def draw(self, screen):
+    def render(self):
+        self.text_image = self.font.render(self.text, 1, self.t_colour)
+        self.text_rect = self.text_image.get_rect()
         self.image.fill(self.colour)
         self.image.blit(self.text_image, self.text_rect)
+
+    def draw(self, screen):
         screen.blit(self.image, self.rect)
 
     def update(self, new_text):
-        self.text = new_text
-        self.text_image = self.font.render(self.text, 1, self.t_colour)
+        if new_text != self.text:
+            self.text = new_text
+            self.render()
 
 
 if __name__ == '__main__':
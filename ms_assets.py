@@ -0,0 +1,35 @@
+import os
+import pygame
+
+# Images and fonts are loaded once per process and shared by every screen, widget and tile.
+# Image names are relative to this file, so the game can be started from any directory.
+directory = os.path.dirname(os.path.abspath(__file__))
+images = {}
+scaled = {}
+fonts = {}
+font_files = {}
+
+
+def get_image(name):
+    # Loaded and converted for the display on first use. The display has to have been created by then.
+    if name not in images:
+        images[name] = pygame.image.load(os.path.join(directory, name)).convert_alpha()
+    return images[name]
+
+
+def get_scaled(name, size):
+    key = (name, tuple(size))
+    if key not in scaled:
+        scaled[key] = pygame.transform.scale(get_image(name), size)
+    return scaled[key]
+
+
+def get_font(face, size):
+    # The system font file for a face is only searched for once, then each size is made from that file.
+    # match_font gives None for a face that isn't installed, which makes Font fall back to pygame's default.
+    key = (face, size)
+    if key not in fonts:
+        if face not in font_files:
+            font_files[face] = pygame.font.match_font(face)
+        fonts[key] = pygame.font.Font(font_files[face], size)
+    return fonts[key]
@@ -0,0 +1,53 @@
+# Plays many games headlessly across a process pool, for load testing the scores database and tuning presets.
+# Usage: python ms_batch.py [games] [width] [height] [mines] [processes]
+
+import random
+import sys
+import time
+from multiprocessing import Pool
+from ms_board import new_game
+
+
+def random_strategy(board, rng):
+    # Reveal hidden cells in a random order until the game is decided.
+    order = list(range(board.size))
+    rng.shuffle(order)
+    moves = 0
+    for i in order:
+        if board.revealed[i]:
+            continue
+        board.reveal(i)
+        moves += 1
+        if board.status() != 'playing':
+            break
+    return moves
+
+
+def play(args):
+    # Play one game. Takes a single tuple so it can be mapped over a Pool.
+    width, height, mines, seed, strategy = args
+    board = new_game(width, height, mines, seed)
+    moves = strategy(board, random.Random(seed))
+    return board.status(), moves
+
+
+def run_batch(games, width, height, mines, processes=None, seed=0, strategy=random_strategy):
+    # Returns a dict of totals. Game n uses seed + n, so a batch is reproducible.
+    start = time.perf_counter()
+    results = {'won': 0, 'lost': 0, 'playing': 0, 'moves': 0}
+    jobs = ((width, height, mines, seed + n, strategy) for n in range(games))
+    with Pool(processes) as pool:
+        for status, moves in pool.imap_unordered(play, jobs, chunksize=max(1, games // 256)):
+            results[status] += 1
+            results['moves'] += moves
+    results['seconds'] = time.perf_counter() - start
+    results['games_per_hour'] = games / results['seconds'] * 3600
+    return results
+
+
+if __name__ == '__main__':
+    defaults = [10000, 15, 15, 20, None]
+    for i, arg in enumerate(sys.argv[1:6]):
+        defaults[i] = int(arg)
+    for k, v in run_batch(*defaults).items():
+        print(k + ':', v)
@@ -0,0 +1,386 @@
+# Timings for the hot paths of the game: building, mining and numbering a board, the flood fill, drawing a frame and
+# the scores database. Runs headless on SDL's dummy video driver.
+#
+# Usage: python ms_benchmark.py [--quick] [--output results.json] [--baseline benchmark_baseline.json]
+#                               [--save-baseline] [--tolerance 1.0] [--rounds 3]
+#        python ms_benchmark.py --check
+# Results are printed as JSON. With a baseline, any timing more than the tolerance slower than it is reported as a
+# regression and the exit status is 1. --save-baseline writes the results as the new baseline instead.
+# --check skips the timings and checks ms_solver against brute force, exiting with 1 if they disagree.
+
+import argparse
+import gc
+import itertools
+import json
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+
+import pygame
+import minesweeper
+import ms_solver
+from ms_board import Board, new_game
+from ms_chunks import CHUNK, ChunkedBoard
+from ms_database import Database
+
+SIZES = [15, 30, 100, 200, 500]
+# Boards played through a Viewport, whose costs should depend on the window and not on these sizes.
+VIEWPORT_SIZES = [500, 1000]
+DENSITIES = [0.1, 0.15, 0.2]
+QUICK_SIZES = [15, 30, 100]
+
+# A timing only counts as a regression if it is also at least this many seconds slower than its baseline, which is
+# about as close as perf_counter and the scheduler let the best of many runs agree.
+MIN_DELTA = 0.00005
+# measure() keeps repeating short timings until this long has gone by, setup included, up to MAX_REPEAT runs.
+MIN_TOTAL = 0.2
+MAX_REPEAT = 50
+
+
+def measure(func, repeat=3, setup=None):
+    # Best of at least repeat runs, so a one-off stall in the sandbox doesn't count as a regression. Short timings are
+    # run more often, until MIN_TOTAL has gone by, as the best of a few millisecond runs still varies a lot. setup is
+    # called untimed before each run, for timings that change what they measure, like a flood fill.
+    best = None
+    runs = 0
+    began = time.perf_counter()
+    while runs < repeat or (time.perf_counter() - began < MIN_TOTAL and runs < MAX_REPEAT):
+        if setup:
+            setup()
+        # As in timeit, a collection starting mid-run would be timed as part of whatever happened to trigger it.
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            func()
+            elapsed = time.perf_counter() - start
+        finally:
+            gc.enable()
+        if best is None or elapsed < best:
+            best = elapsed
+        runs += 1
+    return best
+
+
+def tile_size_for(size):
+    # Keep the grid surface to a sensible size for big boards.
+    return max(2, min(30, 1000 // size))
+
+
+def bench_board(screen, size, density, seed=0):
+    # Time each stage of setting up and playing one board. Returns {path: seconds}.
+    mines = int(size * size * density)
+    tile_size = tile_size_for(size)
+    repeat = 3 if size <= 100 else 1
+    position = (screen.get_width() // 2, screen.get_height() // 2)
+    results = {}
+
+    results['grid.generate_grid'] = measure(lambda: minesweeper.Grid(screen, (size, size), tile_size, position), repeat)
+    grid = minesweeper.Grid(screen, (size, size), tile_size, position)
+
+    def add_mines():
+        grid.board.reset()
+        grid.board.add_mines(mines, random.Random(seed))
+
+    results['grid.add_mines'] = measure(add_mines, repeat)
+    results['grid.assign_text'] = measure(grid.assign_text, repeat)
+
+    results['grid.redraw'] = measure(grid.redraw, repeat)
+
+    # Click the first empty cell, which floods out over its whole open area.
+    empty = [i for i in range(grid.board.size) if not grid.board.mines[i] and not grid.board.numbers[i]]
+    if empty:
+        layout = bytes(grid.board.mines)
+
+        def fresh():
+            grid.board.reset()
+            grid.board.set_mines(layout)
+
+        results['tile.update.flood'] = measure(lambda: grid.cells[empty[0]].update(True, False), repeat, fresh)
+
+        # The next frame draws every tile the flood revealed.
+        def flooded():
+            fresh()
+            grid.board.reveal(empty[0])
+
+        results['grid.update.frame'] = measure(lambda: grid.update(None, None), repeat, flooded)
+
+    return results
+
+
+def bench_viewport(screen, size, density=0.15, seed=0):
+    # Time building a Viewport, drawing it whole, a frame of panning, a zoom and a flood fill in view.
+    results = {}
+    results['viewport.create'] = measure(lambda: minesweeper.make_view(screen, (size, size)))
+    view = minesweeper.make_view(screen, (size, size))
+    view.board.add_mines(int(size * size * density), random.Random(seed))
+
+    results['viewport.redraw'] = measure(view.redraw)
+
+    def pan():
+        view.pan(minesweeper.Viewport.PAN_STEP, 0)
+        view.update(None, None)
+
+    results['viewport.pan'] = measure(pan)
+    results['viewport.zoom'] = measure(lambda: (view.zoom(-1, view.rect.center), view.zoom(1, view.rect.center)))
+
+    empty = [i for i in range(view.board.size) if not view.board.mines[i] and not view.board.numbers[i]]
+    if empty:
+        # The hint brings the cell into view, then it is clicked, flooding out over its open area.
+        view.set_hint(empty[0])
+        view.update(None, None)
+        pos = view.cell_rect(empty[0]).move(view.rect.topleft).center
+        layout = bytes(view.board.mines)
+
+        def fresh():
+            view.board.reset()
+            view.board.set_mines(layout)
+            view.update(None, None)
+
+        results['viewport.update.click'] = measure(lambda: view.update(pos, None), setup=fresh)
+    return results
+
+
+def bench_chunks(chunks=64):
+    # Time making chunks of an endless board, the first click on it, and saving chunks to disk and loading them back.
+    results = {}
+    board = ChunkedBoard(0, capacity=chunks)
+
+    def load():
+        for n in range(chunks):
+            board.chunk(n % 8, n // 8)
+
+    def loaded():
+        board.reset(0)
+        load()
+
+    results['chunks.load'] = measure(load, setup=lambda: board.reset(0)) / chunks
+    results['chunks.reveal.start'] = measure(lambda: board.reveal(board.start), setup=loaded)
+
+    # Flag a cell on every chunk so each one is written out, then bring them all back.
+    def flagged():
+        loaded()
+        for n in range(chunks):
+            board.flag(((n % 8) * CHUNK, (n // 8) * CHUNK))
+
+    def evict_reload():
+        for n in range(chunks):
+            board.chunk(100 + n, 0)
+        load()
+
+    results['chunks.evict_reload'] = measure(evict_reload, setup=flagged) / (2 * chunks)
+    return results
+
+
+def bench_reveal_empty(width=1000, height=1000):
+    # Worst case for the flood fill: a board with no mines, revealed from one click.
+    board = Board(width, height)
+    start = time.perf_counter()
+    changed = board.reveal(0)
+    elapsed = time.perf_counter() - start
+    if len(changed) != board.size:
+        raise RuntimeError('Flood fill revealed ' + str(len(changed)) + ' of ' + str(board.size) + ' cells.')
+    return elapsed
+
+
+def bench_database(scores=10000):
+    # Time queueing and committing a batch of scores, then loading the first leaderboard page from the full table.
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        # Best of a few startups, on a new file each time for cold ones and on the same one for warm ones.
+        startups = {'cold': [], 'warm': []}
+        for n in range(5):
+            for kind, name in (('cold', 'cold{}.db'.format(n)), ('warm', 'bench.db')):
+                db = Database(os.path.join(directory, name))
+                db.close()
+                startups[kind].append(db.startup_time)
+        results['database.startup.cold'] = min(startups['cold'])
+        results['database.startup.warm'] = min(startups['warm'][1:])
+
+        path = os.path.join(directory, 'bench.db')
+        db = Database(path)
+        rng = random.Random(0)
+        start = time.perf_counter()
+        for n in range(scores):
+            db.add_score('user' + str(n), round(rng.uniform(5, 500), 2), '01/01/2021', 15)
+        db.flush()
+        results['database.add_score'] = (time.perf_counter() - start) / scores
+        results['database.return_scores'] = measure(lambda: db.return_scores(15, 10, 0))
+        results['database.return_scores.last_page'] = measure(lambda: db.return_scores(15, 10, scores - 10))
+        db.close()
+    return results
+
+
+def run(sizes):
+    pygame.init()
+    screen = pygame.display.set_mode((850, 650))
+    results = {}
+    for size in sizes:
+        for density in DENSITIES:
+            label = '{0}x{0}/{1:.2f}'.format(size, density)
+            for path, seconds in bench_board(screen, size, density).items():
+                results[path + '/' + label] = seconds
+    for size in VIEWPORT_SIZES:
+        for path, seconds in bench_viewport(screen, size).items():
+            results[path + '/{0}x{0}'.format(size)] = seconds
+    results.update(bench_chunks())
+    results['board.reveal.empty/1000x1000'] = bench_reveal_empty()
+    results.update(bench_database())
+    pygame.quit()
+    return results
+
+
+def run_rounds(sizes, rounds):
+    # The best time for each path over several runs of the whole set. A busy spell on the machine can last longer than
+    # measure() spends on any one path, but is unlikely to hit the same path in every round.
+    best = {}
+    for n in range(rounds):
+        for path, seconds in run(sizes).items():
+            best[path] = min(seconds, best.get(path, seconds))
+    return best
+
+
+def brute_force(board):
+    # Exact mine probabilities for every hidden cell, from every placement of the board's mines that fits the numbers.
+    hidden = [i for i in range(board.size) if not board.revealed[i]]
+    numbered = [(board.numbers[i], board.neighbours(i)) for i in range(board.size)
+                if board.revealed[i] and board.numbers[i]]
+    hits = dict.fromkeys(hidden, 0)
+    total = 0
+    for layout in itertools.combinations(hidden, board.mine_count):
+        placed = set(layout)
+        if all(sum(a in placed for a in around) == count for count, around in numbered):
+            total += 1
+            for cell in layout:
+                hits[cell] += 1
+    return {cell: n / total for cell, n in hits.items()}
+
+
+def random_position(rng, width, height, mines, seed):
+    # A game in progress: the first click and up to three more random safe reveals. None if it is already over.
+    board = new_game(width, height, mines, seed)
+    board.reveal(rng.randrange(board.size))
+    for n in range(rng.randrange(4)):
+        hidden = [i for i in range(board.size) if not board.revealed[i] and not board.mines[i]]
+        if hidden:
+            board.reveal(rng.choice(hidden))
+    return board if board.status() == 'playing' else None
+
+
+def small_positions(rng, cases):
+    # Games in progress on boards small enough to brute force, with the seed each was made from.
+    seed = 0
+    found = 0
+    while found < cases:
+        seed += 1
+        width, height = rng.choice([(4, 4), (5, 4), (5, 5)])
+        board = random_position(rng, width, height, rng.randint(2, 8), seed)
+        if board is None or math.comb(board.size - board.revealed.count(1), board.mine_count) > 20000:
+            continue
+        found += 1
+        yield seed, board
+
+
+def check_solver(cases=400, big_cases=20):
+    # Small boards are compared exactly with brute force. They are then checked again with components of more than a
+    # few cells skipped, as they are on real boards, where only the certain cells have to be right. Big boards use the
+    # solver's estimate, so there the certain cells are only checked against the real mines. Returns a line for every
+    # disagreement.
+    rng = random.Random(0)
+    failures = []
+
+    for seed, board in small_positions(rng, cases):
+        exact = brute_force(board)
+        safe, mines, probabilities = ms_solver.solve(board)
+        for cell, p in exact.items():
+            if cell in safe:
+                found = 0
+            elif cell in mines:
+                found = 1
+            else:
+                found = probabilities.get(cell)
+            if found is None or abs(found - p) > 1e-9:
+                failures.append('{}x{} seed {} cell {}: brute force {:.4f}, solver {}'.format(
+                    board.width, board.height, seed, cell, p, found))
+
+    limit = ms_solver.MAX_COMPONENT
+    ms_solver.MAX_COMPONENT = 4
+    try:
+        for seed, board in small_positions(rng, cases):
+            exact = brute_force(board)
+            safe, mines, probabilities = ms_solver.solve(board)
+            wrong = [i for i in safe if exact[i]] + [i for i in mines if exact[i] != 1]
+            wrong += [i for i, p in probabilities.items() if not 0 <= p <= 1]
+            if wrong:
+                failures.append('{}x{} seed {} with components skipped: wrong about cells {}'.format(
+                    board.width, board.height, seed, sorted(wrong)))
+    finally:
+        ms_solver.MAX_COMPONENT = limit
+
+    for seed in range(big_cases):
+        board = random_position(rng, 60, 60, 540, seed)
+        if board is None:
+            continue
+        safe, mines, probabilities = ms_solver.solve(board)
+        wrong = [i for i in safe if board.mines[i]] + [i for i in mines if not board.mines[i]]
+        wrong += [i for i, p in probabilities.items() if not 0 <= p <= 1]
+        if wrong:
+            failures.append('60x60 seed {}: wrong about cells {}'.format(seed, sorted(wrong)[:10]))
+
+    print('Checked the solver on {} small boards twice and {} big boards.'.format(cases, big_cases))
+    return failures
+
+
+def compare(results, baseline, tolerance):
+    # Returns a line for every timing more than tolerance, and more than MIN_DELTA, slower than its baseline.
+    regressions = []
+    for path, seconds in sorted(results.items()):
+        before = baseline.get(path)
+        if before is None or seconds - before < MIN_DELTA:
+            continue
+        if seconds > before * (1 + tolerance):
+            regressions.append('{}: {:.4f}s -> {:.4f}s ({:+.0%})'.format(path, before, seconds, seconds / before - 1))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time the game\'s hot paths.')
+    parser.add_argument('--quick', action='store_true', help='only boards up to 100x100')
+    parser.add_argument('--output', help='also write the results to this file')
+    parser.add_argument('--baseline', default='benchmark_baseline.json')
+    parser.add_argument('--save-baseline', action='store_true')
+    # Even the best of three rounds of each timing can still come out most of twice as slow on a busy machine, so by
+    # default only a path that has doubled counts. Use a lower tolerance on a quiet one.
+    parser.add_argument('--tolerance', type=float, default=1.0)
+    parser.add_argument('--rounds', type=int, default=3, help='keep the best of this many runs of every benchmark')
+    parser.add_argument('--check', action='store_true', help='check the solver against brute force instead')
+    args = parser.parse_args()
+
+    if args.check:
+        failures = check_solver()
+        for line in failures:
+            print('Mismatch: ' + line, file=sys.stderr)
+        sys.exit(1 if failures else 0)
+
+    results = run_rounds(QUICK_SIZES if args.quick else SIZES, args.rounds)
+    text = json.dumps(results, indent=2, sort_keys=True)
+    print(text)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            f.write(text)
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print('Regression: ' + line, file=sys.stderr)
+        if regressions:
+            sys.exit(1)
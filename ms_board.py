@@ -0,0 +1,199 @@
+import random
+from collections import deque
+
+
+class Board:
+
+    # Board object holds the state of a game in flat bytearrays, one byte per cell, indexed by row * width + col.
+    # Tile and Grid in minesweeper are views over this, so everything else can work on plain integers.
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.size = width * height
+
+        self.mines = bytearray(self.size)
+        self.numbers = bytearray(self.size)
+        self.revealed = bytearray(self.size)
+        self.flagged = bytearray(self.size)
+
+        # Cells whose revealed or flagged state has changed since the last time a renderer cleared this list.
+        self.changed = []
+
+        # Index offsets of the eight neighbours of a cell not on the edge of the board.
+        w = self.width
+        self.offsets = (-w - 1, -w, -w + 1, -1, 1, w - 1, w, w + 1)
+
+        self.reset()
+
+    def reset(self):
+        # Clear the board in place so it can be used for another game without reallocating anything.
+        blank = bytes(self.size)
+        self.mines[:] = blank
+        self.numbers[:] = blank
+        self.revealed[:] = blank
+        self.flagged[:] = blank
+        del self.changed[:]
+
+        self.mine_count = 0
+        self.deferred = None
+        self.lost = False
+
+        # Running totals kept up to date on every reveal and flag, so checking for a win never has to scan the board.
+        self.flags = 0
+        self.correct_flags = 0
+        self.revealed_safe = 0
+
+    def index(self, row, col):
+        return row * self.width + col
+
+    def position(self, index):
+        # Returns (row, col) for a cell index.
+        return divmod(index, self.width)
+
+    def neighbours(self, index):
+        row, col = divmod(index, self.width)
+        if 0 < row < self.height - 1 and 0 < col < self.width - 1:
+            return [index + o for o in self.offsets]
+
+        # Cells on the edge of the board fall back to clipping the 3x3 square.
+        result = []
+        for r in range(max(row - 1, 0), min(row + 2, self.height)):
+            for c in range(max(col - 1, 0), min(col + 2, self.width)):
+                if r != row or c != col:
+                    result.append(r * self.width + c)
+        return result
+
+    def add_mines(self, mines, rng=random, safe=None):
+        # Place mines on distinct random cells in a single pass, keeping the safe cell and, if there is room, its
+        # neighbours clear, then count every cell's adjacent mines in one pass over the whole field.
+        excluded = []
+        if safe is not None:
+            excluded = sorted(self.neighbours(safe) + [safe])
+            if mines > self.size - len(excluded):
+                excluded = [safe]
+        if mines > self.size - len(excluded):
+            raise ValueError(str(mines) + ' mines will not fit on a ' + str(self.width) + 'x' + str(self.height) +
+                             ' board.')
+
+        # Sample from the cells that are left once the excluded ones are taken out, then shift each pick past them.
+        for i in rng.sample(range(self.size - len(excluded)), mines):
+            for e in excluded:
+                if i >= e:
+                    i += 1
+            self.mines[i] = 1
+
+        self.mine_count = self.mines.count(1)
+        self.assign_numbers()
+        # Flags can be placed before deferred mines are laid, so recount which of them turned out to be right.
+        self.correct_flags = sum(1 for i in range(self.size) if self.flagged[i] and self.mines[i]) if self.flags else 0
+
+    def set_mines(self, mines):
+        # Use a given mine layout, such as one from the no-guess generator, in place of random placement.
+        self.mines[:] = mines
+        self.mine_count = self.mines.count(1)
+        self.deferred = None
+        self.assign_numbers()
+
+    def defer_mines(self, mines, rng=random):
+        # Leave mine placement until the first reveal, so the first click can never be on or next to a mine.
+        self.deferred = (mines, rng)
+        self.mine_count = mines
+
+    def assign_numbers(self):
+        # Recount every cell's adjacent mines from scratch. Mines get a count too, though it is never shown.
+        self.numbers[:] = count_adjacent(self.mines, self.width, self.height)
+
+    def reveal(self, index):
+        # Reveal a cell and, if it has no adjacent mines, flood out to every connected empty cell and its numbered border.
+        # Returns the list of cells that were newly revealed so callers only have to act on those.
+        if self.revealed[index]:
+            return []
+        if self.deferred:
+            mines, rng = self.deferred
+            self.deferred = None
+            self.add_mines(mines, rng, index)
+
+        self.revealed[index] = 1
+        if self.flagged[index]:
+            self.flagged[index] = 0
+            self.flags -= 1
+            self.correct_flags -= self.mines[index]
+        changed = [index]
+        if self.mines[index]:
+            self.lost = True
+            self.changed.append(index)
+            return changed
+        self.revealed_safe += 1
+        if self.numbers[index]:
+            self.changed.append(index)
+            return changed
+
+        # The revealed array doubles as the visited set, so each cell is queued at most once.
+        revealed, flagged, numbers = self.revealed, self.flagged, self.numbers
+        queue = deque(changed)
+        while queue:
+            current = queue.pop()
+            for a in self.neighbours(current):
+                if revealed[a] or flagged[a]:
+                    continue
+                revealed[a] = 1
+                changed.append(a)
+                if not numbers[a]:
+                    queue.append(a)
+
+        # Everything reached by the flood borders an empty cell, so none of it can be a mine.
+        self.revealed_safe += len(changed) - 1
+        self.changed.extend(changed)
+        return changed
+
+    def flag(self, index):
+        # Toggle the flag on a hidden cell. Returns False if the cell is already revealed.
+        if self.revealed[index]:
+            return False
+
+        self.flagged[index] ^= 1
+        step = 1 if self.flagged[index] else -1
+        self.flags += step
+        if self.mines[index]:
+            self.correct_flags += step
+        self.changed.append(index)
+        return True
+
+    def status(self):
+        # Returns 'lost' once a mine has been revealed, 'won' once every safe cell is revealed or every mine is flagged
+        # with no wrong flags, and 'playing' otherwise.
+        if self.lost:
+            return 'lost'
+        if self.deferred:
+            return 'playing'
+        if self.revealed_safe == self.size - self.mine_count:
+            return 'won'
+        if self.flags == self.correct_flags == self.mine_count:
+            return 'won'
+        return 'playing'
+
+
+def count_adjacent(mines, width, height):
+    # Count the mines around every cell at once. The mine array is packed into one big integer with a byte per cell,
+    # and the eight neighbours are added as shifted copies of it. A count is at most 8, so bytes never carry into
+    # each other, and column masks stop the left and right shifts wrapping between rows.
+    size = width * height
+    field = int.from_bytes(mines, 'big')
+    not_first = int.from_bytes((b'\0' + b'\1' * (width - 1)) * height, 'big')
+    not_last = int.from_bytes((b'\1' * (width - 1) + b'\0') * height, 'big')
+
+    rows = field + ((field & not_first) << 8) + ((field & not_last) >> 8)
+    row_bits = 8 * width
+    total = (rows + (rows << row_bits) + (rows >> row_bits)) & ((1 << (8 * size)) - 1)
+
+    # total is the 3x3 sum, which includes the cell itself.
+    return (total - field).to_bytes(size, 'big')
+
+
+def new_game(width, height, mines, seed=None):
+    # Create a board without needing pygame. Mines are laid on the first reveal, and the same seed and first click
+    # always give the same board.
+    board = Board(width, height)
+    board.defer_mines(mines, random.Random(seed))
+    return board
@@ -0,0 +1,189 @@
+import os
+import random
+import tempfile
+import zlib
+from collections import OrderedDict, deque
+from ms_board import Board, count_adjacent
+
+# Chunks are CHUNK x CHUNK cells.
+CHUNK = 64
+DENSITY = 0.15
+# Below this, empty areas can join up without end and a single click could flood forever.
+MIN_DENSITY = 0.12
+
+
+class ChunkedBoard:
+
+    # An endless board, made of CHUNK x CHUNK chunks that are only made when something first looks at them. Each
+    # chunk is a Board of its own. Its mines come from the seed and its position alone, so they never have to be
+    # stored, and its numbers count the mines in the chunks around it too. Only the most recently used chunks are kept
+    # in memory. Evicted chunks that have been played on have their revealed and flagged cells saved to disk, and
+    # everything else is made again from the seed when it is next needed.
+    # Cells are (x, y) pairs, which can be negative. The first click should be on start, which is always clear.
+
+    def __init__(self, seed=None, density=DENSITY, capacity=256, directory=None):
+        if not MIN_DENSITY <= density < 1:
+            raise ValueError('Endless boards need a mine density between ' + str(MIN_DENSITY) + ' and 1.')
+        self.density = density
+        self.capacity = capacity
+        self.mines_per_chunk = round(density * CHUNK * CHUNK)
+        self.start = (CHUNK // 2, CHUNK // 2)
+
+        self.temp = None
+        if directory is None:
+            self.temp = tempfile.TemporaryDirectory(prefix='ms_chunks_')
+            directory = self.temp.name
+        self.directory = directory
+
+        # Loaded chunks by (cx, cy), least recently used first, and the mine layouts generated for them and their
+        # neighbours, which are cheap to make again.
+        self.chunks = OrderedDict()
+        self.layouts = OrderedDict()
+        self.saved = set()
+        # Used to lay each chunk's mines with Board.add_mines.
+        self.scratch = Board(CHUNK, CHUNK)
+
+        self.changed = []
+        self.reset(seed)
+
+    def reset(self, seed=None):
+        # Start a new world, from seed or a random one.
+        self.seed = random.randrange(2 ** 32) if seed is None else seed
+        self.chunks.clear()
+        self.layouts.clear()
+        for key in self.saved:
+            os.remove(self.path(key))
+        self.saved.clear()
+        del self.changed[:]
+        self.last = (None, None)
+
+        self.lost = False
+        self.flags = 0
+        self.revealed_safe = 0
+
+    def path(self, key):
+        return os.path.join(self.directory, '{}_{}.chunk'.format(*key))
+
+    def layout(self, cx, cy):
+        # The mines of a chunk, the same every time for the same seed. The start cell and its neighbours are kept clear.
+        key = (cx, cy)
+        mines = self.layouts.get(key)
+        if mines is None:
+            safe = None
+            if key == (0, 0):
+                safe = self.start[1] * CHUNK + self.start[0]
+            self.scratch.reset()
+            self.scratch.add_mines(self.mines_per_chunk, random.Random('{}:{}:{}'.format(self.seed, cx, cy)), safe)
+            mines = bytes(self.scratch.mines)
+            self.layouts[key] = mines
+            # Each chunk loaded needs its eight neighbours' layouts, so keep enough for every loaded chunk's.
+            while len(self.layouts) > 4 * self.capacity:
+                self.layouts.popitem(last=False)
+        else:
+            self.layouts.move_to_end(key)
+        return mines
+
+    def count(self, cx, cy):
+        # Numbers for a chunk, counted over it and a one cell border taken from the chunks around it.
+        size = CHUNK + 2
+        padded = bytearray(size * size)
+        for row in range(size):
+            # Rows 0 and size - 1 of the padding come from the chunks above and below.
+            ry, ly = divmod(row - 1 + CHUNK, CHUNK)
+            left, middle, right = (self.layout(cx + dx, cy + ry - 1) for dx in (-1, 0, 1))
+            start = ly * CHUNK
+            padded[row * size:(row + 1) * size] = (left[start + CHUNK - 1:start + CHUNK] + middle[start:start + CHUNK] +
+                                                   right[start:start + 1])
+        counts = count_adjacent(padded, size, size)
+        return b''.join(counts[(row + 1) * size + 1:(row + 1) * size + 1 + CHUNK] for row in range(CHUNK))
+
+    def load(self, cx, cy):
+        board = Board(CHUNK, CHUNK)
+        board.mines[:] = self.layout(cx, cy)
+        board.mine_count = self.mines_per_chunk
+        board.numbers[:] = self.count(cx, cy)
+        if (cx, cy) in self.saved:
+            with open(self.path((cx, cy)), 'rb') as f:
+                state = zlib.decompress(f.read())
+            board.revealed[:] = state[:board.size]
+            board.flagged[:] = state[board.size:]
+        return board
+
+    def evict(self):
+        # Drop the least recently used chunk, saving what has been revealed and flagged on it, if anything.
+        key, board = self.chunks.popitem(last=False)
+        if board.revealed.find(1) != -1 or board.flagged.find(1) != -1:
+            with open(self.path(key), 'wb') as f:
+                f.write(zlib.compress(bytes(board.revealed) + bytes(board.flagged)))
+            self.saved.add(key)
+
+    def chunk(self, cx, cy):
+        key = (cx, cy)
+        board = self.chunks.get(key)
+        if board is None:
+            board = self.load(cx, cy)
+            self.chunks[key] = board
+            while len(self.chunks) > self.capacity:
+                self.evict()
+        else:
+            self.chunks.move_to_end(key)
+        self.last = (key, board)
+        return board
+
+    def locate(self, cell):
+        # Returns (chunk, index in it) for a cell. Runs of lookups in one chunk, as in a flood fill, skip the LRU.
+        cx, x = divmod(cell[0], CHUNK)
+        cy, y = divmod(cell[1], CHUNK)
+        key, board = self.last
+        if key != (cx, cy):
+            board = self.chunk(cx, cy)
+        return board, y * CHUNK + x
+
+    def reveal(self, cell):
+        # As Board.reveal, but the flood fill carries on across chunks, making them as it reaches them.
+        board, i = self.locate(cell)
+        if board.revealed[i]:
+            return []
+        board.revealed[i] = 1
+        if board.flagged[i]:
+            board.flagged[i] = 0
+            self.flags -= 1
+        changed = [cell]
+        if board.mines[i]:
+            self.lost = True
+            self.changed.append(cell)
+            return changed
+        self.revealed_safe += 1
+        if board.numbers[i]:
+            self.changed.append(cell)
+            return changed
+
+        queue = deque(changed)
+        while queue:
+            x, y = queue.pop()
+            for a in ((x - 1, y - 1), (x, y - 1), (x + 1, y - 1), (x - 1, y), (x + 1, y), (x - 1, y + 1),
+                      (x, y + 1), (x + 1, y + 1)):
+                board, i = self.locate(a)
+                if board.revealed[i] or board.flagged[i]:
+                    continue
+                board.revealed[i] = 1
+                changed.append(a)
+                if not board.numbers[i]:
+                    queue.append(a)
+
+        self.revealed_safe += len(changed) - 1
+        self.changed.extend(changed)
+        return changed
+
+    def flag(self, cell):
+        board, i = self.locate(cell)
+        if board.revealed[i]:
+            return False
+        board.flagged[i] ^= 1
+        self.flags += 1 if board.flagged[i] else -1
+        self.changed.append(cell)
+        return True
+
+    def status(self):
+        # An endless board can't be won, only lost.
+        return 'lost' if self.lost else 'playing'
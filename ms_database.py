@@ -1,40 +1,157 @@
+import queue
 import sqlite3
+import sys
+import threading
+import time
+import ms_profile
+
+# Applied to every connection. WAL lets the leaderboard keep reading while the writer thread commits, and with WAL
+# synchronous=normal is still safe against corruption. A negative cache_size is in KiB.
+PRAGMAS = ['pragma journal_mode=wal', 'pragma synchronous=normal', 'pragma cache_size=-8000']
+
+
+# (width, height, mines) for each preset board's leaderboard, which is named after its width. These are the boards
+# main.py's preset Loaders make.
+PRESETS = {'15': (15, 15, 20), '20': (20, 20, 40), '30': (30, 30, 80)}
+
+
+def custom_config(width, height, mines):
+    # Leaderboard name for a custom board. The presets just use their width.
+    return '{}x{}/{}'.format(width, height, mines)
+
+
+class ScoreWriter(threading.Thread):
+
+    # Background thread that takes scores off a queue and inserts them, committing everything waiting in one transaction.
+    # It has its own connection, as sqlite connections can't be shared between threads.
+
+    def __init__(self, path):
+        threading.Thread.__init__(self, daemon=True)
+        self.path = path
+        self.queue = queue.Queue()
+        self.start()
+
+    def run(self):
+        db = sqlite3.connect(self.path)
+        for pragma in PRAGMAS:
+            db.execute(pragma)
+        running = True
+        while running:
+            batch = [self.queue.get()]
+            while not self.queue.empty():
+                batch.append(self.queue.get())
+
+            # Items are score rows, Events from flush() to set once the rows before them are written, or None to stop.
+            rows = [item for item in batch if isinstance(item, tuple)]
+            if rows:
+                # A failed batch is rolled back and reported, and the thread carries on so flush() never hangs.
+                try:
+                    with ms_profile.span('database.write'), db:
+                        db.executemany('insert into Scores (Config, User, Time, Date, Replay) values (?, ?, ?, ?, ?)',
+                                       rows)
+                except sqlite3.Error as e:
+                    print('Could not save ' + str(len(rows)) + ' score(s): ' + str(e), file=sys.stderr)
+            for item in batch:
+                if item is None:
+                    running = False
+                elif isinstance(item, threading.Event):
+                    item.set()
+        db.close()
+
+    def add(self, row):
+        self.queue.put(row)
+
+    def flush(self):
+        # Block until every score queued so far has been committed.
+        done = threading.Event()
+        self.queue.put(done)
+        done.wait()
+
+    def close(self):
+        self.queue.put(None)
+        self.join()
 
 
 class Database:
 
-    def __init__(self):
-        self.db = sqlite3.connect('minesweeper_db.db')
+    def __init__(self, path='minesweeper_db.db'):
+        start = time.perf_counter()
+        self.path = path
+        self.db = sqlite3.connect(path)
         self.cursor = self.db.cursor()
+        for pragma in PRAGMAS:
+            self.cursor.execute(pragma)
+
+        # Each migration brings the schema up one version. The version reached is stored in the file's user_version.
+        self.migrations = [self.create, self.add_replays]
         self.db_check()
 
+        self.writer = ScoreWriter(path)
+        self.startup_time = time.perf_counter() - start
+        if ms_profile.enabled:
+            ms_profile.record('database.startup', start, start + self.startup_time)
+
     def db_check(self):
-        self.cursor.execute('select name from sqlite_master where name=?', ('SkidMarksDatabase.db',))
-        result = self.cursor.fetchall()
-        if len(result) != 1:
-            self.create()
+        self.cursor.execute('pragma user_version')
+        version = self.cursor.fetchone()[0]
+        if version >= len(self.migrations):
+            return
+
+        # Run every outstanding migration in a single transaction.
+        self.cursor.execute('begin')
+        try:
+            for migration in self.migrations[version:]:
+                migration()
+            self.cursor.execute('pragma user_version=' + str(len(self.migrations)))
+        except sqlite3.Error:
+            self.db.rollback()
+            raise
+        self.db.commit()
 
     def create(self):
-        table_names = {
-            'Scores15': '''Score_ID integer, User text, Time double, Date text, primary key(Score_ID)''',
-            'Scores20': '''Score_ID integer, User text, Time double, Date text, primary key(Score_ID)''',
-            'Scores30': '''Score_ID integer, User text, Time double, Date text, primary key(Score_ID)'''
-                        }
+        # All scores live in one table, with Config saying which board they were set on (e.g. '15' for 15x15).
+        # The index on (Config, Time) lets leaderboard pages be read straight off it in order.
+        self.cursor.execute('''create table if not exists Scores (Score_ID integer primary key autoincrement,
+                               Config text, User text, Time double, Date text)''')
+        self.cursor.execute('create index if not exists Scores_Config_Time on Scores (Config, Time)')
+        self.migrate()
 
-        for k, v in table_names.items():
-            sql = 'create table if not exists ' + k + '(' + v + ')'
-            self.cursor.execute(sql)
-            self.db.commit()
+    def migrate(self):
+        # Older versions kept a table per board size. Move their rows across and drop them.
+        for config in ('15', '20', '30'):
+            self.cursor.execute('select name from sqlite_master where type=? and name=?', ('table', 'Scores' + config))
+            if self.cursor.fetchall():
+                self.cursor.execute('insert into Scores (Config, User, Time, Date) select ?, User, Time, Date from Scores'
+                                    + config + ' order by Score_ID', (config,))
+                self.cursor.execute('drop table Scores' + config)
 
-    def return_scores(self, table):
-        self.cursor.execute('select User, Time, Date from Scores' + str(table))
-        return self.cursor.fetchall()
+    def add_replays(self):
+        # Each score can carry the ms_replay recording of the game that set it, so suspicious times can be checked.
+        self.cursor.execute('alter table Scores add column Replay blob')
 
-    def add_score(self, user, time, date, table):
-        self.cursor.execute('select * from Scores' + str(table))
-        s_id = len(self.cursor.fetchall()) + 1
+    def return_scores(self, table, limit=-1, offset=0):
+        # Fastest first. A limit of -1 returns every row after the offset.
+        with ms_profile.span('database.return_scores'):
+            self.cursor.execute('select User, Time, Date from Scores where Config=? order by Time limit ? offset ?',
+                                (str(table), limit, offset))
+            return self.cursor.fetchall()
 
-        sql = 'insert into Scores' + str(table) + ' (Score_ID, User, Time, Date) values (?, ?, ?, ?)'
-        self.cursor.execute(sql, (s_id, user, time, date,))
+    def return_replays(self):
+        # Every score saved with a replay, as (Score_ID, Config, User, Time, Replay) rows.
+        with ms_profile.span('database.return_replays'):
+            self.cursor.execute('select Score_ID, Config, User, Time, Replay from Scores where Replay is not null '
+                                'order by Config, Time')
+            return self.cursor.fetchall()
 
-        self.db.commit()
+    def add_score(self, user, time, date, table, replay=None):
+        # Scores are written by the background ScoreWriter, so this returns straight away. Call flush() to wait for it.
+        self.writer.add((str(table), user, time, date, replay))
+
+    def flush(self):
+        with ms_profile.span('database.flush'):
+            self.writer.flush()
+
+    def close(self):
+        # Write out anything still queued before closing.
+        self.writer.close()
+        self.db.close()
@@ -0,0 +1,28 @@
+import pygame
+
+
+class EventLoop:
+
+    # Shared driver for the menu and result screens. Rather than spinning, it sleeps in pygame.event.wait until there
+    # is input, waking at least every timeout ms, and never lets a screen redraw more than fps times a second.
+    # Screens only redraw when redraw is set, which happens whenever input arrives.
+
+    def __init__(self, fps=30, timeout=250):
+        self.clock = pygame.time.Clock()
+        self.fps = fps
+        self.timeout = timeout
+        self.redraw = True
+
+    def wait(self):
+        # Returns every pending event, blocking until there is at least one or the timeout passes.
+        self.clock.tick(self.fps)
+        event = pygame.event.wait(self.timeout)
+        events = [] if event.type == pygame.NOEVENT else [event]
+        events += pygame.event.get()
+        if events:
+            self.redraw = True
+        return events
+
+    def drawn(self):
+        # Call after a screen has redrawn and flipped the display.
+        self.redraw = False
@@ -0,0 +1,118 @@
+# Generates boards that can be cleared from the first click by deduction alone, so the player never has to guess.
+
+import multiprocessing
+import os
+import queue
+import random
+import threading
+from ms_board import Board
+from ms_solver import solve
+
+# How many layouts each worker tries before reporting back.
+ATTEMPTS_PER_TASK = 4
+
+# Worker processes shared by every BoardPool, made the first time one needs them. See shared_pool.
+workers = None
+workers_lock = threading.Lock()
+
+
+def first_click(width, height):
+    # No-guess boards are solved from, and opened at, the middle cell.
+    return (height // 2) * width + width // 2
+
+
+def solvable(mines, width, height, first):
+    # Play the layout from the first click, only ever revealing cells the solver is certain are safe.
+    board = Board(width, height)
+    board.set_mines(mines)
+    board.reveal(first)
+    while board.status() == 'playing':
+        safe, known, probabilities = solve(board)
+        if not safe:
+            return False
+        for cell in safe:
+            board.reveal(cell)
+    return board.status() == 'won'
+
+
+def attempt(args):
+    # Try a few seeded layouts. Returns the first that needs no guessing, or None. Takes one tuple to map over a Pool.
+    width, height, mines, seed = args
+    first = first_click(width, height)
+    for n in range(ATTEMPTS_PER_TASK):
+        board = Board(width, height)
+        board.add_mines(mines, random.Random(seed + n), first)
+        if solvable(board.mines, width, height, first):
+            return bytes(board.mines)
+    return None
+
+
+def make_pool(processes=None):
+    # Workers are spawned rather than forked, as forking the game while its pygame and database threads are running
+    # can leave a worker stuck on a lock it copied in a locked state.
+    return multiprocessing.get_context('spawn').Pool(processes)
+
+
+def shared_pool():
+    # One set of workers serves every preset, rather than a full set of processes per BoardPool.
+    global workers
+    with workers_lock:
+        if workers is None:
+            workers = make_pool()
+        return workers
+
+
+def shutdown():
+    # Stop the shared workers, e.g. when the game exits.
+    global workers
+    with workers_lock:
+        if workers is not None:
+            workers.terminate()
+            workers = None
+
+
+def generate(width, height, mines, seed=None, pool=None):
+    # Retry layouts across a process pool until one can be cleared without guessing, and return its mine array.
+    # Work is handed out a batch at a time and results are taken in order, so the same seed gives the same board.
+    if seed is None:
+        seed = random.randrange(2 ** 32)
+    if pool is None:
+        with make_pool() as pool:
+            return generate(width, height, mines, seed, pool)
+
+    batch = (os.cpu_count() or 1) * 2
+    n = 0
+    while True:
+        tasks = [(width, height, mines, seed + (n + i) * ATTEMPTS_PER_TASK) for i in range(batch)]
+        n += batch
+        for result in pool.imap(attempt, tasks):
+            if result:
+                return result
+
+
+class BoardPool:
+
+    # Keeps a few no-guess layouts for one preset generated ahead of time on a background thread,
+    # so a game can start as soon as it is asked for.
+
+    def __init__(self, width, height, mines, size=2):
+        self.width = width
+        self.height = height
+        self.mines = mines
+        self.first = first_click(width, height)
+        self.boards = queue.Queue(size)
+
+        self.thread = threading.Thread(target=self.fill, daemon=True)
+        self.thread.start()
+
+    def fill(self):
+        while True:
+            # put blocks while the pool is full, so generation stops until a board is taken.
+            self.boards.put(generate(self.width, self.height, self.mines, pool=shared_pool()))
+
+    def ready(self):
+        return not self.boards.empty()
+
+    def take(self):
+        # Waits if no board is ready yet. Check ready() first to avoid blocking the UI.
+        return self.boards.get()
@@ -0,0 +1,93 @@
+# Opt-in instrumentation for the game loop and the scores database. Run with --profile, or set MS_PROFILE (to the
+# trace file to write, if not ms_trace.json), to turn it on. While it is on, Game shows an overlay with the FPS, p50/p99
+# frame time and dirty-cell count, and on exit every span recorded is written out in the Chrome trace event format,
+# which chrome://tracing and Perfetto can open. While it is off, span() hands back a shared do-nothing context.
+
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+
+enabled = '--profile' in sys.argv or bool(os.environ.get('MS_PROFILE'))
+trace_path = os.environ.get('MS_PROFILE') if os.environ.get('MS_PROFILE') not in (None, '', '1') else 'ms_trace.json'
+
+# Oldest spans are dropped past this, so a long session can't use up memory.
+MAX_EVENTS = 500000
+# Frame times kept for the overlay's percentiles, about ten seconds at 60fps.
+FRAME_WINDOW = 600
+
+origin = time.perf_counter()
+events = deque(maxlen=MAX_EVENTS)
+frames = deque(maxlen=FRAME_WINDOW)
+
+
+class Span:
+
+    # Times the code inside a with block and records it under name, along with the thread it ran on.
+
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record(self.name, self.start, time.perf_counter())
+
+
+class Off:
+
+    # Stands in for Span while profiling is off.
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+OFF = Off()
+
+
+def span(name):
+    return Span(name) if enabled else OFF
+
+
+def record(name, start, end, args=None):
+    # deque.append is atomic, so the score writer thread can record spans too.
+    events.append((name, start, end, threading.get_ident(), args))
+
+
+def frame(start, end, dirty):
+    # Record one frame of the game loop, from handling its events to updating the display, and how many cells it drew.
+    frames.append(end - start)
+    record('frame', start, end, {'dirty cells': dirty})
+
+
+def percentile(p):
+    # Frame time in seconds that p percent of the recent frames came in under.
+    if not frames:
+        return 0
+    ordered = sorted(frames)
+    return ordered[min(int(len(ordered) * p / 100), len(ordered) - 1)]
+
+
+def export(path=None):
+    # Write everything recorded as a Chrome trace: a complete ('X') event per span, with times in microseconds, and a
+    # counter track for the dirty cells drawn each frame.
+    if not enabled:
+        return
+    pid = os.getpid()
+    trace = []
+    for name, start, end, tid, args in list(events):
+        ts = (start - origin) * 1e6
+        trace.append({'name': name, 'ph': 'X', 'ts': ts, 'dur': (end - start) * 1e6, 'pid': pid, 'tid': tid})
+        for key, value in (args or {}).items():
+            trace.append({'name': key, 'ph': 'C', 'ts': ts, 'pid': pid, 'tid': tid, 'args': {key: value}})
+    with open(path or trace_path, 'w') as f:
+        json.dump({'traceEvents': trace, 'displayTimeUnit': 'ms'}, f)
@@ -0,0 +1,204 @@
+# Compact binary replays of games, for auditing leaderboard times and for checking changes to the engine against a
+# corpus of recorded games. A replay holds the board's size, seed and mine layout, and every reveal, flag and hint with
+# the time it happened, and plays back deterministically on a fresh Board.
+#
+# Usage: python ms_replay.py replay.msr ...          fast-forward each file and check it ends as it was recorded
+#        python ms_replay.py --watch replay.msr      play one back in real time
+#        python ms_replay.py --audit [database]      check the replay saved with every score
+#        python ms_replay.py --export dir [database] write the replay saved with every score to dir
+
+import os
+import struct
+import sys
+import time
+from ms_board import Board
+from ms_database import PRESETS, custom_config
+
+MAGIC = b'MSRP'
+VERSION = 1
+# Magic, version, width, height, mines, whether there is a seed, seed, result, safe cells revealed, number of actions.
+HEADER = struct.Struct('<4sBHHIBqBII')
+# Milliseconds since the start of the game, cell index, action.
+ACTION = struct.Struct('<IIB')
+
+REVEAL = 0
+FLAG = 1
+HINT = 2
+RESULTS = ('playing', 'won', 'lost')
+
+# The mine layout is stored a bit per cell. Going through a string of '0's and '1's lets int() do the packing.
+TO_DIGITS = bytes.maketrans(b'\0\1', b'01')
+FROM_DIGITS = bytes.maketrans(b'01', b'\0\1')
+
+
+class Replay:
+
+    # One recorded game. Game adds each action as it happens and calls finish with the board once it is over.
+
+    def __init__(self, width, height, mines, seed=None):
+        self.width = width
+        self.height = height
+        self.mines = mines
+        self.seed = seed
+        self.layout = bytes(width * height)
+        self.result = 'playing'
+        self.revealed = 0
+        # (milliseconds, index, action) tuples, in the order they happened.
+        self.actions = []
+
+    def add(self, seconds, action, index):
+        self.actions.append((int(seconds * 1000), index, action))
+
+    def finish(self, board):
+        # Take the mine layout, which isn't known until the first reveal, and the outcome from the finished board.
+        self.layout = bytes(board.mines)
+        self.mines = board.mine_count
+        self.result = board.status()
+        self.revealed = board.revealed_safe
+
+    @property
+    def duration(self):
+        # Seconds from the start of the game to the last action.
+        return self.actions[-1][0] / 1000 if self.actions else 0
+
+    def to_bytes(self):
+        has_seed = isinstance(self.seed, int) and -2 ** 63 <= self.seed < 2 ** 63
+        header = HEADER.pack(MAGIC, VERSION, self.width, self.height, self.mines, has_seed,
+                             self.seed if has_seed else 0, RESULTS.index(self.result), self.revealed, len(self.actions))
+        digits = self.layout.translate(TO_DIGITS)
+        layout = int(digits, 2).to_bytes((len(self.layout) + 7) // 8, 'big')
+        return b''.join([header, layout] + [ACTION.pack(*action) for action in self.actions])
+
+    @classmethod
+    def from_bytes(cls, data):
+        if len(data) < HEADER.size or data[:4] != MAGIC:
+            raise ValueError('Not a replay.')
+        magic, version, width, height, mines, has_seed, seed, result, revealed, count = HEADER.unpack_from(data)
+        if version != VERSION:
+            raise ValueError('Unsupported replay version ' + str(version) + '.')
+
+        replay = cls(width, height, mines, seed if has_seed else None)
+        size = width * height
+        start = HEADER.size
+        end = start + (size + 7) // 8
+        if len(data) != end + count * ACTION.size:
+            raise ValueError('Replay is truncated or corrupt.')
+        digits = format(int.from_bytes(data[start:end], 'big'), '0' + str(size) + 'b').encode()
+        replay.layout = digits.translate(FROM_DIGITS)
+        replay.result = RESULTS[result]
+        replay.revealed = revealed
+        replay.actions = list(ACTION.iter_unpack(data[end:]))
+        return replay
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            f.write(self.to_bytes())
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            return cls.from_bytes(f.read())
+
+
+def apply(board, action, index):
+    # Hints don't change the board, so they are only shown when watching.
+    if action == REVEAL:
+        board.reveal(index)
+    elif action == FLAG:
+        board.flag(index)
+
+
+def play(replay, board=None):
+    # Fast-forward through every action. Pass a board of the same size to reuse it when playing many replays.
+    if board is None or (board.width, board.height) != (replay.width, replay.height):
+        board = Board(replay.width, replay.height)
+    else:
+        board.reset()
+    board.set_mines(replay.layout)
+    for ms, index, action in replay.actions:
+        apply(board, action, index)
+    return board
+
+
+def check(replay, board=None):
+    # True if playing the replay back ends the way it did when it was recorded.
+    board = play(replay, board)
+    return board.status() == replay.result and board.revealed_safe == replay.revealed
+
+
+def watch(path, speed=1.0):
+    import pygame
+    import minesweeper
+    pygame.init()
+    screen = pygame.display.set_mode((850, 650))
+    pygame.display.set_caption('Mine Sweeper - ' + os.path.basename(path))
+    minesweeper.Playback(screen, Replay.load(path), speed).run()
+    pygame.quit()
+
+
+def verify(paths):
+    # Fast-forward every replay given, reporting any that no longer end as recorded. Returns the number that failed.
+    replays = [(path, Replay.load(path)) for path in paths]
+    board = None
+    failed = 0
+    start = time.perf_counter()
+    for path, replay in replays:
+        board = play(replay, board)
+        if board.status() != replay.result or board.revealed_safe != replay.revealed:
+            failed += 1
+            print('{}: recorded {} with {} revealed, played back {} with {} revealed'.format(
+                path, replay.result, replay.revealed, board.status(), board.revealed_safe))
+    elapsed = time.perf_counter() - start
+    print('{} replays, {} failed, {:.0f} games/s'.format(len(replays), failed, len(replays) / max(elapsed, 1e-9)))
+    return failed
+
+
+def audit(database):
+    # A score is suspect if its replay doesn't play back to a win on the right board, or if the time recorded is
+    # shorter than the replay itself. Returns the number of suspect scores.
+    suspect = 0
+    board = None
+    for score_id, config, user, seconds, data in database.return_replays():
+        try:
+            replay = Replay.from_bytes(data)
+        except ValueError as e:
+            problem = str(e)
+        else:
+            board = play(replay, board)
+            # The mines that count are the ones in the layout played, whatever the header says.
+            played = (replay.width, replay.height, replay.layout.count(1))
+            if config != custom_config(*played) and PRESETS.get(config) != played:
+                problem = 'replay is for a {}x{} board with {} mines'.format(*played)
+            elif board.status() != 'won':
+                problem = 'replay ends ' + board.status()
+            elif seconds < round(replay.duration, 2):
+                problem = 'replay takes {:.2f}s'.format(replay.duration)
+            else:
+                continue
+        suspect += 1
+        print('Score {} ({}, {}, {:.2f}s): {}'.format(score_id, config, user, seconds, problem))
+    print(str(suspect) + ' suspect scores')
+    return suspect
+
+
+def export(database, directory):
+    os.makedirs(directory, exist_ok=True)
+    rows = database.return_replays()
+    for score_id, config, user, seconds, data in rows:
+        with open(os.path.join(directory, '{}_{}.msr'.format(config, score_id)), 'wb') as f:
+            f.write(data)
+    print('Exported ' + str(len(rows)) + ' replays')
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    if args[:1] == ['--watch']:
+        watch(args[1])
+    elif args[:1] in (['--audit'], ['--export']):
+        import ms_database
+        db = ms_database.Database(*args[2 if args[0] == '--export' else 1:])
+        failures = audit(db) if args[0] == '--audit' else export(db, args[1])
+        db.close()
+        sys.exit(1 if failures else 0)
+    else:
+        sys.exit(1 if verify(args) else 0)
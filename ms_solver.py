@@ -0,0 +1,263 @@
+# Works out what a player can know about a Board from its revealed cells and their numbers alone.
+# Flags are ignored, since the player may have put them in the wrong place.
+
+from itertools import compress, filterfalse
+from math import comb
+
+# Frontier components with more cells than this are not enumerated, as the number of layouts grows exponentially.
+# Their cells are treated as unconstrained instead.
+MAX_COMPONENT = 24
+# On boards with more cells than this, frontier components are weighted independently (see enumerate_frontier).
+EXACT_SIZE = 2500
+# Turns the revealed array into one that is non-zero for hidden cells, to pick them out with itertools.compress.
+HIDDEN = bytes.maketrans(b'\0\1', b'\1\0')
+
+
+def solve(board):
+    # Returns (safe, mines, probabilities). safe and mines are sets of hidden cells that are certainly clear or certainly
+    # mined, and probabilities maps every other hidden cell to its chance of being a mine, where that can be worked out.
+    if board.deferred:
+        return set(), set(), {}
+
+    safe = set()
+    mines = set()
+    border = numbered(board)
+    while propagate(board, safe, mines, border):
+        pass
+
+    frontier, others, rest = enumerate_frontier(board, safe, mines, border)
+    for cell, p in frontier.items():
+        if p == 0:
+            safe.add(cell)
+        elif p == 1:
+            mines.add(cell)
+    # Every cell no number touches shares one probability. On a big board that is nearly all of them, so they go in
+    # first, in one go.
+    probabilities = {}
+    if rest == 0:
+        safe.update(others)
+    elif rest == 1:
+        mines.update(others)
+    elif rest is not None:
+        probabilities = dict.fromkeys(others, rest)
+    probabilities.update((cell, p) for cell, p in frontier.items() if 0 < p < 1)
+    return safe, mines, probabilities
+
+
+def numbered(board):
+    # Every revealed number. bytearray.find skips the hidden cells, which are most of a big board early on.
+    cells = []
+    revealed, numbers, mines = board.revealed, board.numbers, board.mines
+    i = revealed.find(1)
+    while i != -1:
+        if numbers[i] and not mines[i]:
+            cells.append(i)
+        i = revealed.find(1, i + 1)
+    return cells
+
+
+def constraints(board, safe, mines, border):
+    # One (cells, count) pair per revealed number still touching unknown cells: count of those cells are mines. border
+    # is the list of revealed numbers to look at. Those with no unknown cells left are dropped from it, as cells only
+    # ever become known.
+    result = set()
+    revealed, numbers = board.revealed, board.numbers
+    touching = []
+    for i in border:
+        unknown = []
+        count = numbers[i]
+        for a in board.neighbours(i):
+            if a in mines:
+                count -= 1
+            elif not revealed[a] and a not in safe:
+                unknown.append(a)
+        if unknown:
+            touching.append(i)
+            result.add((frozenset(unknown), count))
+    border[:] = touching
+    return result
+
+
+def propagate(board, safe, mines, border):
+    # Apply the single-cell rules, then the subset and pair rules. Returns True if anything new was found.
+    found = set()
+    known = constraints(board, safe, mines, border)
+    for cells, count in known:
+        if count == 0:
+            safe.update(cells)
+            found.update(cells)
+        elif count == len(cells):
+            mines.update(cells)
+            found.update(cells)
+    if found:
+        return True
+
+    # Compare each pair of constraints that share a cell. If B has as many more mines than A as it has cells A
+    # doesn't, those cells are all mines and A's cells outside B are all safe. When A is inside B this also covers
+    # B having the same count as A, which makes the cells of B outside A safe.
+    by_cell = {}
+    for c in known:
+        for cell in c[0]:
+            by_cell.setdefault(cell, []).append(c)
+    for a_cells, a_count in known:
+        others = set()
+        for cell in a_cells:
+            others.update(by_cell[cell])
+        for b_cells, b_count in others:
+            only_b = b_cells - a_cells
+            if only_b and b_count - a_count == len(only_b):
+                mines.update(only_b)
+                safe.update(a_cells - b_cells)
+                found.update(only_b)
+            elif only_b and a_cells <= b_cells and b_count == a_count:
+                safe.update(only_b)
+                found.update(only_b)
+    return bool(found)
+
+
+def components(known):
+    # Split the constraints into groups that share no cells, so each group can be enumerated on its own.
+    groups = []
+    for c in known:
+        merged = [g for g in groups if not g[0].isdisjoint(c[0])]
+        cells, members = set(c[0]), [c]
+        for g in merged:
+            cells |= g[0]
+            members += g[1]
+            groups.remove(g)
+        groups.append((cells, members))
+    return groups
+
+
+def count_layouts(cells, members):
+    # Try every way of placing mines on the cells that satisfies all the constraints, by backtracking.
+    # Returns {mines used: [number of layouts, {cell: layouts with a mine there}]}.
+    cells = sorted(cells, key=lambda cell: -sum(cell in m[0] for m in members))
+    remaining = [m[1] for m in members]
+    unassigned = [len(m[0]) for m in members]
+    touching = {cell: [j for j, m in enumerate(members) if cell in m[0]] for cell in cells}
+    layout = []
+    results = {}
+
+    def place(n):
+        if n == len(cells):
+            k = sum(layout)
+            entry = results.setdefault(k, [0, {}])
+            entry[0] += 1
+            for cell, mine in zip(cells, layout):
+                if mine:
+                    entry[1][cell] = entry[1].get(cell, 0) + 1
+            return
+        cell = cells[n]
+        for mine in (0, 1):
+            ok = True
+            for j in touching[cell]:
+                left = remaining[j] - mine
+                if left < 0 or left > unassigned[j] - 1:
+                    ok = False
+                    break
+            if not ok:
+                continue
+            for j in touching[cell]:
+                remaining[j] -= mine
+                unassigned[j] -= 1
+            layout.append(mine)
+            place(n + 1)
+            layout.pop()
+            for j in touching[cell]:
+                remaining[j] += mine
+                unassigned[j] += 1
+
+    place(0)
+    return results
+
+
+def convolve(tables):
+    # Combine per-component {mines: layouts} tables into one for the total across all of them.
+    total = {0: 1}
+    for table in tables:
+        combined = {}
+        for a, x in total.items():
+            for b, y in table.items():
+                combined[a + b] = combined.get(a + b, 0) + x * y
+        total = combined
+    return total
+
+
+def enumerate_frontier(board, safe, mines, border):
+    # Mine probabilities for the hidden cells, weighting every frontier layout by how many ways the rest of the
+    # board's mines could be spread over the cells no number touches. Returns ({frontier cell: probability}, the other
+    # hidden cells, their probability), or None for that if it can't be worked out.
+    known = constraints(board, safe, mines, border)
+    groups = []
+    skipped = []
+    for g in components(known):
+        if len(g[0]) <= MAX_COMPONENT:
+            groups.append(g)
+        else:
+            skipped.extend(g[0])
+    frontier = set()
+    for c in known:
+        frontier |= c[0]
+
+    # Cells of components too big to enumerate go in with the cells no number touches. Their numbers are ignored, so
+    # the weights allow more layouts than really fit, but never rule out one that does, and a cell is still only
+    # certain if it is certain in every layout.
+    hidden = compress(range(board.size), board.revealed.translate(HIDDEN))
+    others = list(filterfalse((safe | mines | frontier).__contains__, hidden)) + skipped
+    left = board.mine_count - len(mines)
+    results = [count_layouts(cells, members) for cells, members in groups]
+    if board.size > EXACT_SIZE:
+        return estimate_frontier(results, groups, others, left)
+    tables = [{k: v[0] for k, v in r.items()} for r in results]
+
+    def weight(k):
+        return comb(len(others), left - k) if 0 <= left - k <= len(others) else 0
+
+    everything = convolve(tables)
+    total = sum(ways * weight(k) for k, ways in everything.items())
+    if not total:
+        return {}, others, None
+
+    probabilities = {}
+    for n, result in enumerate(results):
+        rest = convolve(tables[:n] + tables[n + 1:])
+        for k, (layouts, hits) in result.items():
+            ways = sum(w * weight(k + j) for j, w in rest.items())
+            for cell in groups[n][0]:
+                probabilities[cell] = probabilities.get(cell, 0) + hits.get(cell, 0) * ways
+    for cell in probabilities:
+        probabilities[cell] /= total
+
+    if not others:
+        return probabilities, others, None
+    expected = sum(ways * weight(k) * (left - k) for k, ways in everything.items()) / total
+    return probabilities, others, expected / len(others)
+
+
+def estimate_frontier(results, groups, others, left):
+    # On a big board, tying every component to the exact number of mines left means multiplying huge binomials across
+    # hundreds of components. With that many unconstrained cells, each extra mine in a layout makes it less likely by
+    # about the odds of any one of them being a mine, so components are weighted by that alone, independently. Returns
+    # the same as enumerate_frontier.
+    probabilities = {}
+    density = left / (len(others) + sum(len(g[0]) for g in groups)) if left > 0 else 0
+    if not 0 < density < 1:
+        return probabilities, others, None
+    odds = density / (1 - density)
+    expected = 0
+    for n, result in enumerate(results):
+        total = sum(layouts * odds ** k for k, (layouts, hits) in result.items())
+        if not total:
+            continue
+        for k, (layouts, hits) in result.items():
+            for cell, count in hits.items():
+                probabilities[cell] = probabilities.get(cell, 0) + count * odds ** k / total
+        for cell in groups[n][0]:
+            probabilities.setdefault(cell, 0)
+            expected += probabilities[cell]
+
+    # This is only an estimate, so it must never make the unconstrained cells certain. If it comes out at 0 or 1 they
+    # are left out instead.
+    rest = (left - expected) / len(others) if others else 0
+    return probabilities, others, rest if 0 < rest < 1 else None